@@ -0,0 +1,366 @@
+"""
+Load tests a local server with a swarm of headless bots
+
+    python benchmarks/bot_swarm.py [--bots 50] [--rooms 5] [--duration 20]
+    python benchmarks/bot_swarm.py --scenario scenario.json --json results.json
+
+Every room gets one drawer, it starts the game, draws strokes, sends frames and skips
+words now and then. Everyone else guesses words from the word list. Round trip time
+is from sending a guess to getting it back in the room's chat. Connect time is the
+TCP connect, join time lasts until the first lobby update (those are debounced).
+
+Unless --no-server is given the server is started for the run, so its CPU time and
+memory can be read from /proc. A scenario file holds the same settings as the command
+line plus "limits", when any limit is broken the exit code is 1 so a release check
+can fail on it:
+
+    {"bots": 200, "rooms": 20, "limits": {"rtt_p99_ms": 50, "server_rss_mb": 300}}
+"""
+
+import argparse
+import heapq
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import deque
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy
+
+import client
+
+WORD_LIST = os.path.join(ROOT, "server", "WordList.txt")
+
+DEFAULTS = {
+    "host": "127.0.0.1",
+    "port": 16324,
+    "bots": 50,
+    "rooms": 5,
+    "duration": 20.0,
+    # seconds over which the bots connect
+    "ramp": 2.0,
+    # per second, per guessing bot
+    "guess_rate": 1.0,
+    # per second, per drawing bot
+    "stroke_rate": 24.0,
+    "frame_rate": 0.0,
+    "skip_rate": 0.05,
+    "points_per_stroke": 3,
+    "limits": {},
+}
+
+LIMITS = {
+    "connect_p99_ms": "connect time p99",
+    "join_p99_ms": "join time p99",
+    "rtt_p50_ms": "round trip p50",
+    "rtt_p99_ms": "round trip p99",
+    "server_cpu_percent": "server CPU",
+    "server_rss_mb": "server RSS",
+    "lost_bots": "bots lost",
+}
+
+
+class Bot(client.Client):
+    """
+    A Client that times the chat coming back instead of printing it
+    """
+
+    def __init__(self, address, name, room):
+        self.started = time.perf_counter()
+        self.joined = None
+        self.round_trips = []
+        self._pending = deque()
+        super(Bot, self).__init__(address, name, room=room)
+        self.connected = time.perf_counter()
+
+    def guess(self, word):
+        self._pending.append((f"{self.name}: {word}", time.perf_counter()))
+        self._send(b"WORD", word)
+
+    def process_packet(self, packet, fields):
+        if packet == b"LOBY" and self.joined is None:
+            self.joined = time.perf_counter()
+
+        if packet == b"CHAT":
+            message = fields[0]
+            # a correct guess comes back as "_WON name: word", before the game
+            # started as a message saying so
+            if self._pending and (
+                message.endswith(self._pending[0][0])
+                or message.startswith("You cant guess yet")
+            ):
+                _, sent = self._pending.popleft()
+                self.round_trips.append(time.perf_counter() - sent)
+            return
+
+        super(Bot, self).process_packet(packet, fields)
+
+    @property
+    def alive(self):
+        return self._running
+
+
+class ServerProcess:
+    """
+    Reads CPU time and resident memory of the server and its worker processes
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self._ticks = os.sysconf("SC_CLK_TCK")
+
+    def _pids(self):
+        pids = [self.pid]
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as file:
+                        if int(file.read().rsplit(")", 1)[1].split()[1]) == self.pid:
+                            pids.append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    ...
+        return pids
+
+    def cpu_seconds(self):
+        total = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/stat") as file:
+                    fields = file.read().rsplit(")", 1)[1].split()
+                total += int(fields[11]) + int(fields[12])
+            except OSError:
+                ...
+        return total / self._ticks
+
+    def rss_mb(self):
+        total = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/status") as file:
+                    for line in file:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1])
+            except OSError:
+                ...
+        return total / 1024
+
+
+def percentile(values, fraction):
+    if not values:
+        return math.nan
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_swarm(settings, words):
+    rng = random.Random(0)
+    address = (settings["host"], settings["port"])
+    bots: list[Bot] = []
+    drawers = set()
+
+    # connect everyone over the ramp, the first bot of each room draws
+    for index in range(settings["bots"]):
+        room = f"room{index % settings['rooms']}"
+        bot = Bot(address, f"bot{index:05d}"[-10:], room)
+        bot.daemon = True
+        bot.start()
+        bots.append(bot)
+        if index < settings["rooms"]:
+            drawers.add(bot)
+        time.sleep(settings["ramp"] / settings["bots"])
+
+    deadline = time.perf_counter() + 5
+    while any(bot.joined is None for bot in bots) and time.perf_counter() < deadline:
+        time.sleep(0.05)
+
+    for bot in drawers:
+        bot.request_game_start()
+
+    canvas = numpy.full((1080, 1920), 0xE8FCFF, dtype=numpy.uint32)
+    events = []
+
+    def schedule(at, bot, action, rate):
+        if rate > 0:
+            # spread out so the bots do not all act on the same tick
+            heapq.heappush(events, (at + rng.expovariate(rate), id(bot), bot, action))
+
+    now = time.perf_counter()
+    for bot in bots:
+        if bot in drawers:
+            schedule(now, bot, "stroke", settings["stroke_rate"])
+            schedule(now, bot, "frame", settings["frame_rate"])
+            schedule(now, bot, "skip", settings["skip_rate"])
+        else:
+            schedule(now, bot, "guess", settings["guess_rate"])
+
+    sent_before = sum(bot.bytes_sent for bot in bots)
+    received_before = sum(bot.bytes_received for bot in bots)
+    start = time.perf_counter()
+    end = start + settings["duration"]
+    strokes = {}
+
+    while events and events[0][0] < end:
+        at, _, bot, action = heapq.heappop(events)
+        time.sleep(max(at - time.perf_counter(), 0))
+
+        if not bot.alive:
+            continue
+
+        try:
+            if action == "guess":
+                bot.guess(rng.choice(words))
+                schedule(at, bot, action, settings["guess_rate"])
+
+            elif action == "stroke":
+                x, y = strokes.get(bot, (960, 540))
+                points = []
+                for _ in range(settings["points_per_stroke"]):
+                    x = min(max(x + rng.randint(-15, 15), 0), 1919)
+                    y = min(max(y + rng.randint(-15, 15), 0), 1079)
+                    points.append((x, y))
+                strokes[bot] = (x, y)
+
+                if rng.random() < 0.05:
+                    bot.send_canvas_event(("end",))
+                    bot.send_canvas_event(("begin", "Drawing", (0, 0, 0), 5))
+                bot.send_canvas_event(("points", points))
+                schedule(at, bot, action, settings["stroke_rate"])
+
+            elif action == "frame":
+                x, y = strokes.get(bot, (960, 540))
+                canvas[y : y + 5, x : x + 5] = rng.randrange(1 << 24)
+                bot._send_frame(canvas)
+                schedule(at, bot, action, settings["frame_rate"])
+
+            elif action == "skip":
+                bot.request_word_skip()
+                schedule(at, bot, action, settings["skip_rate"])
+
+        except OSError:
+            ...
+
+    elapsed = time.perf_counter() - start
+    time.sleep(0.5)
+
+    connects = [bot.connected - bot.started for bot in bots]
+    joins = [bot.joined - bot.started for bot in bots if bot.joined]
+
+    results = {
+        "bots": len(bots),
+        "lost_bots": sum(not bot.alive for bot in bots),
+        "connect_p50_ms": percentile(connects, 0.5) * 1000,
+        "connect_p99_ms": percentile(connects, 0.99) * 1000,
+        "join_p50_ms": percentile(joins, 0.5) * 1000,
+        "join_p99_ms": percentile(joins, 0.99) * 1000,
+        "never_joined": sum(bot.joined is None for bot in bots),
+        "sent_bytes_per_second": (sum(bot.bytes_sent for bot in bots) - sent_before)
+        / elapsed,
+        "received_bytes_per_second": (
+            sum(bot.bytes_received for bot in bots) - received_before
+        )
+        / elapsed,
+    }
+
+    round_trips = [rtt for bot in bots for rtt in bot.round_trips]
+    results["round_trips"] = len(round_trips)
+    for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+        results[f"rtt_{name}_ms"] = percentile(round_trips, fraction) * 1000
+    results["rtt_max_ms"] = max(round_trips, default=math.nan) * 1000
+
+    for bot in bots:
+        bot.close()
+    for bot in bots:
+        bot.join(1)
+
+    return results, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", help="JSON file of settings and limits")
+    for key, default in DEFAULTS.items():
+        if key != "limits":
+            parser.add_argument(f"--{key.replace('_', '-')}", type=type(default))
+    parser.add_argument(
+        "--no-server", action="store_true", help="use a server that is already running"
+    )
+    parser.add_argument(
+        "--server-args", default="", help="extra arguments for the started server"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    settings = dict(DEFAULTS)
+    if args.scenario:
+        with open(args.scenario) as file:
+            settings.update(json.load(file))
+    for key in DEFAULTS:
+        value = getattr(args, key, None)
+        if value is not None:
+            settings[key] = value
+
+    with open(WORD_LIST, encoding="utf-8") as file:
+        words = [word.strip() for word in file.read().split("\n") if word.strip()]
+
+    server = None
+    if not args.no_server:
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "server.py",
+                "--http-port",
+                "0",
+                *args.server_args.split(),
+            ],
+            cwd=os.path.join(ROOT, "server"),
+            stdout=subprocess.DEVNULL,
+        )
+        time.sleep(2)
+
+    try:
+        process = ServerProcess(server.pid) if server else None
+        cpu_before = process.cpu_seconds() if process else 0
+
+        results, elapsed = run_swarm(settings, words)
+
+        if process:
+            results["server_cpu_percent"] = (
+                (process.cpu_seconds() - cpu_before) / elapsed * 100
+            )
+            results["server_rss_mb"] = process.rss_mb()
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    for key, value in results.items():
+        print(
+            f"{key:26s} {value:12.1f}"
+            if isinstance(value, float)
+            else f"{key:26s} {value:12d}"
+        )
+
+    failed = []
+    for key, limit in settings["limits"].items():
+        value = results.get(key)
+        if value is None or not value <= limit:
+            failed.append(f"{LIMITS.get(key, key)} is {value}, limit {limit}")
+
+    results["failed"] = failed
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"settings": settings, "results": results}, file, indent=4)
+
+    for failure in failed:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Measures the FRME codec on a simulated drawing session
+
+    python benchmarks/frame_codec.py [--frames 240] [--pen 5]
+
+Reports the bytes per frame sent and the time spent encoding and decoding them.
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+
+from frame_codec import FrameDecoder, FrameEncoder
+from raster import rasterize_stroke
+
+CANVAS_BACKGROUND = (232, 252, 255)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=240)
+    parser.add_argument("--pen", type=int, default=5)
+    parser.add_argument("--tile-size", type=int, default=64)
+    args = parser.parse_args()
+
+    canvas = pygame.Surface((1920, 1080))
+    canvas.fill(CANVAS_BACKGROUND)
+
+    encoder = FrameEncoder(tile_size=args.tile_size)
+    decoder = FrameDecoder()
+    history = []
+
+    sizes, keyframe_sizes = [], []
+    encode_time = decode_time = 0.0
+
+    for i in range(args.frames):
+        # 24 fps frames of a pen moving in a spiral, 2-3 mouse samples per frame
+        points = []
+        for step in range(3):
+            t = (i * 3 + step) / 20
+            points.append(
+                (int(960 + math.cos(t) * t * 20), int(540 + math.sin(t) * t * 12))
+            )
+
+        rasterize_stroke(canvas, points, (0, 0, 0), args.pen, history)
+        history = (history + points)[-2:]
+
+        frame = pygame.surfarray.pixels2d(canvas).T
+
+        start = time.perf_counter()
+        payload = encoder.encode(frame)
+        encode_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = decoder.decode(payload)
+        decode_time += time.perf_counter() - start
+
+        del frame
+        expected = pygame.surfarray.pixels3d(canvas).transpose(1, 0, 2)
+        assert (decoded == expected).all(), "decoded frame does not match"
+        del expected
+        (keyframe_sizes if payload[0] & 1 else sizes).append(len(payload))
+
+    raw = 1920 * 1080 * 3
+    average = (sum(sizes) + sum(keyframe_sizes)) / args.frames
+
+    print(f"frames            {args.frames}")
+    print(f"raw frame         {raw} bytes")
+    print(
+        f"keyframes         {len(keyframe_sizes)}, avg {sum(keyframe_sizes) / len(keyframe_sizes):.0f} bytes"
+    )
+    print(
+        f"delta frames      {len(sizes)}, avg {sum(sizes) / max(len(sizes), 1):.0f} bytes"
+    )
+    print(f"bytes per frame   {average:.0f} ({raw / average:.0f}x smaller than raw)")
+    print(f"bytes per second  {average * 24:.0f} at 24 fps")
+    print(f"encode time       {encode_time / args.frames * 1000:.2f} ms per frame")
+    print(f"decode time       {decode_time / args.frames * 1000:.2f} ms per frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Close guess detection, the deletion table against plain Levenshtein over the list
+
+    python benchmarks/guess_matcher.py [--guesses 2000] [--distance 2]
+
+Guesses are words from the list with random typos plus random junk. Both approaches
+must find the same words, the time per guess is reported for each.
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"),
+)
+
+from guess_matcher import GuessMatcher, normalize
+
+WORD_LIST = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "server",
+    "WordList.txt",
+)
+
+
+def levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+def naive_lookup(words, guess, distance):
+    guess = normalize(guess)
+    return {word for word in words if levenshtein(guess, word) <= distance}
+
+
+def typo(rng, word):
+    letters = list(word)
+    for _ in range(rng.randrange(0, 3)):
+        position = rng.randrange(len(letters) + 1)
+        action = rng.randrange(3)
+        if action == 0:
+            letters.insert(position, rng.choice(string.ascii_lowercase))
+        elif letters and action == 1:
+            del letters[min(position, len(letters) - 1)]
+        elif letters:
+            letters[min(position, len(letters) - 1)] = rng.choice(
+                string.ascii_lowercase
+            )
+    return "".join(letters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--guesses", type=int, default=2000)
+    parser.add_argument("--distance", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with open(WORD_LIST, encoding="utf-8") as file:
+        listed = [word.strip() for word in file.read().split("\n") if word.strip()]
+
+    start = time.perf_counter()
+    matcher = GuessMatcher(listed, args.distance)
+    build_time = time.perf_counter() - start
+
+    words = list(dict.fromkeys(normalize(word) for word in listed))
+    guesses = [
+        (
+            typo(rng, rng.choice(words))
+            if rng.random() < 0.8
+            else "".join(rng.choices(string.ascii_lowercase, k=rng.randrange(3, 12)))
+        )
+        for _ in range(args.guesses)
+    ]
+
+    start = time.perf_counter()
+    indexed = [matcher.lookup(guess) for guess in guesses]
+    index_time = time.perf_counter() - start
+
+    naive_count = min(len(guesses), 200)
+    start = time.perf_counter()
+    naive = [
+        naive_lookup(words, guess, args.distance) for guess in guesses[:naive_count]
+    ]
+    naive_time = time.perf_counter() - start
+
+    for guess, found, expected in zip(guesses, indexed, naive):
+        # the table also counts swapped letters as one edit, so it may find more
+        assert expected <= set(found), f"{guess!r}: missed {expected - set(found)}"
+
+    start = time.perf_counter()
+    for guess in guesses:
+        matcher.check(guess, words[0])
+    check_time = time.perf_counter() - start
+
+    print(f"words             {len(matcher)}")
+    print(f"index build       {build_time * 1000:.0f} ms")
+    print(f"table lookup      {index_time / len(guesses) * 1e6:.1f} us per guess")
+    print(f"naive lookup      {naive_time / naive_count * 1e6:.1f} us per guess")
+    print(
+        f"speedup           {naive_time / naive_count / (index_time / len(guesses)):.0f}x"
+    )
+    print(f"check vs a word   {check_time / len(guesses) * 1e6:.1f} us per guess")
+
+
+if __name__ == "__main__":
+    main()
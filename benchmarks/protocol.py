@@ -0,0 +1,153 @@
+"""
+Round trip fuzzing and throughput of the packet codec
+
+    python benchmarks/protocol.py [--packets 20000] [--seed 0]
+
+Random packets of every type are encoded, cut into random sized pieces and parsed
+back, any difference fails loudly. Then packets are pushed through a socket pair.
+"""
+
+import argparse
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+
+
+def random_string(rng):
+    alphabet = "abcdefghijklmnopqrstuvwxyz _:!?éü漢字🎨"
+    return "".join(rng.choice(alphabet) for _ in range(rng.randrange(0, 40)))
+
+
+def random_field(rng, kind):
+    if kind == protocol.STRING:
+        return random_string(rng)
+    elif kind == protocol.INT:
+        return rng.randrange(0, 2**32)
+    elif kind == protocol.STRINGS:
+        return [random_string(rng) for _ in range(rng.randrange(0, 20))]
+    elif kind == protocol.POINTS:
+        return [
+            (rng.randrange(-(2**15), 2**15), rng.randrange(-(2**15), 2**15))
+            for _ in range(rng.randrange(0, 50))
+        ]
+    elif kind == protocol.BLOB:
+        return rng.randbytes(rng.randrange(0, 5000))
+    elif kind == protocol.TIME:
+        return rng.uniform(0, 2e9)
+
+
+def random_packet(rng):
+    opcode = rng.choice(list(protocol.PACKETS))
+    return opcode, [random_field(rng, kind) for kind in protocol.PACKETS[opcode]]
+
+
+def fuzz(rng, count):
+    packets = [random_packet(rng) for _ in range(count)]
+    stream = b"".join(protocol.encode(opcode, *fields) for opcode, fields in packets)
+
+    parser = protocol.PacketParser()
+    received = []
+    offset = 0
+
+    while offset < len(stream):
+        # anything from single bytes to several packets at once
+        size = rng.choice((1, 2, 3, 7, rng.randrange(1, 20000)))
+        parser.feed(stream[offset : offset + size])
+        offset += size
+
+        while (packet := parser.next_packet()) is not None:
+            received.append(packet)
+
+    assert len(parser) == 0, "bytes left over after the last packet"
+    assert received == packets, "packets changed on the way through"
+
+    # garbage must be refused rather than misread
+    parser = protocol.PacketParser()
+    parser.feed(b"NOPE" + stream[:100])
+    try:
+        parser.next_packet()
+    except protocol.ProtocolError:
+        pass
+    else:
+        raise AssertionError("unknown opcode was accepted")
+
+    return len(stream)
+
+
+def throughput(packet, count):
+    opcode, fields = packet
+
+    start = time.perf_counter()
+    for _ in range(count):
+        data = protocol.encode(opcode, *fields)
+    encode_time = time.perf_counter() - start
+
+    parser = protocol.PacketParser()
+    parser.feed(data * count)
+    start = time.perf_counter()
+    while parser.next_packet() is not None:
+        pass
+    parse_time = time.perf_counter() - start
+
+    left, right = socket.socketpair()
+    reader = protocol.PacketReader(right)
+
+    def send():
+        for _ in range(count):
+            left.sendall(protocol.encode(opcode, *fields))
+
+    sender = threading.Thread(target=send)
+    start = time.perf_counter()
+    sender.start()
+    for _ in range(count):
+        reader.read_packet()
+    socket_time = time.perf_counter() - start
+    sender.join()
+
+    reader.close()
+    left.close()
+    right.close()
+
+    return len(data), encode_time, parse_time, socket_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--packets", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    start = time.perf_counter()
+    size = fuzz(rng, args.packets)
+    print(
+        f"fuzz              {args.packets} packets, {size} bytes round tripped"
+        f" in {time.perf_counter() - start:.2f} s"
+    )
+
+    cases = {
+        "CHAT": (b"CHAT", ["bobby: is it a cat?"]),
+        "STPT 3 points": (b"STPT", [0, [(100, 200), (103, 204), (107, 209)]]),
+        "FILL": (b"FILL", [0, 500, 400, 0xFF0000, 0]),
+        "FRME 1.5 KB": (b"FRME", [bytes(1500)]),
+    }
+
+    for name, packet in cases.items():
+        size, encode_time, parse_time, socket_time = throughput(packet, args.packets)
+        print(
+            f"{name:17s} {size:5d} bytes, encode {args.packets / encode_time:9.0f}/s,"
+            f" parse {args.packets / parse_time:9.0f}/s,"
+            f" over a socket {args.packets / socket_time:9.0f}/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Times the renderer's drawing paths headless, against a stored baseline
+
+    python benchmarks/renderer.py [--repeat 5] [--json results.json]
+    python benchmarks/renderer.py --update-baseline
+
+A Renderer is built on SDL's dummy video driver with a stub in place of the server
+connection. Every case does what one frame of the game would, then puts the changed
+areas on the display the same way the render loop does:
+
+    stroke/pen<size>    a batch of points added to a stroke
+    fill/<size>         a flood fill of a square region
+    chat/<length>       a chat message of that many characters arriving
+    textbox             a key typed into the guess box, TextEntryBox.refresh and render
+    options_menu        the right click menu drawn, opened and closed again
+    composite           redrawing the whole screen
+
+The best of --repeat rounds is kept per case. Any case slower than the baseline by
+more than --tolerance fails the run with exit code 1, so a slow change shows up
+before it is pushed. Baselines depend on the machine, write your own with
+--update-baseline before comparing against it.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+# the renderer loads its font and images relative to the repository
+os.chdir(ROOT)
+
+import pygame
+
+from main import Renderer, TextEntryBox, entryboxes
+
+BASELINE = os.path.join(ROOT, "benchmarks", "renderer_baseline.json")
+PEN_SIZES = (1, 5, 25, 45)
+FILL_SIZES = (64, 256, 1024)
+CHAT_LENGTHS = (10, 100, 1000)
+POINTS_PER_FRAME = 4
+
+
+class StubClient:
+    """
+    Just enough of client.Client for the renderer, nothing goes over the network
+    """
+
+    def __init__(self):
+        self.chat_log = []
+        self.word_pattern = "loading..."
+        self.round_end = None
+        self.has_canvas_events = False
+        self.on_update = None
+
+    def send_canvas_event(self, event):
+        ...
+
+    def canvas_events(self):
+        return iter(())
+
+
+def bench_stroke(renderer, pen_size, iterations, rng):
+    renderer._canvas_event(("begin", "Drawing", (0, 0, 0), pen_size))
+    x, y = 960, 540
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        points = []
+        for _ in range(POINTS_PER_FRAME):
+            x = min(max(x + rng.randint(-8, 8), 0), 1919)
+            y = min(max(y + rng.randint(-8, 8), 0), 1079)
+            points.append((x, y))
+        renderer.drawing(points)
+        renderer.present()
+    elapsed = time.perf_counter() - start
+
+    renderer._canvas_event(("end",))
+    return elapsed
+
+
+def bench_fill(renderer, size, iterations, rng):
+    renderer.clear_screen()
+    canvas = renderer._Renderer__canvas
+    region = pygame.Rect(0, 0, size, size)
+    region.center = canvas.get_rect().center
+    pygame.draw.rect(canvas, (0, 0, 0), region.inflate(2, 2), width=1)
+    renderer.present()
+
+    start = time.perf_counter()
+    for index in range(iterations):
+        # a different colour each time so the whole region is filled again
+        rgb = (index % 2 * 200, rng.randrange(256), 0)
+        renderer._canvas_event(("fill", region.center, rgb, 0))
+        renderer.present()
+    return time.perf_counter() - start
+
+
+def bench_chat(renderer, length, iterations, rng):
+    words = ["paint", "brush", "a", "guess", "banana", "longer_word", "is", "it"]
+
+    messages = []
+    for _ in range(iterations):
+        message = ""
+        while len(message) < length:
+            message += rng.choice(words) + " "
+        messages.append(message[:length])
+
+    start = time.perf_counter()
+    for message in messages:
+        renderer.server.chat_log.append(message)
+        renderer._track_overlay_changes()
+        renderer.present()
+    return time.perf_counter() - start
+
+
+def bench_textbox(renderer, iterations, rng):
+    # the guess box, made first in run()
+    box = entryboxes[0]
+    box.text_box_clicked()
+    letters = "abcdefghijklmnopqrstuvwxyz "
+
+    start = time.perf_counter()
+    for index in range(iterations):
+        if index % 32 == 0:
+            box.reset_strings()
+        letter = rng.choice(letters)
+        box.update_string(
+            pygame.event.Event(pygame.KEYDOWN, key=ord(letter), unicode=letter)
+        )
+        renderer._track_overlay_changes()
+        renderer.present()
+    elapsed = time.perf_counter() - start
+
+    box.writing = False
+    box.reset_strings(default=True)
+    return elapsed
+
+
+def bench_options_menu(renderer, iterations, rng):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        # what a right click and then closing it again does
+        renderer.options_menu()
+        renderer._Renderer__settings_pos = (rng.randrange(1500), rng.randrange(600))
+        renderer._Renderer__options_menu_open = True
+        renderer._track_overlay_changes()
+        renderer.present()
+
+        renderer._Renderer__options_menu_open = False
+        renderer._track_overlay_changes()
+        renderer.present()
+    return time.perf_counter() - start
+
+
+def bench_composite(renderer, iterations, rng):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        renderer._composite()
+        pygame.display.update()
+    return time.perf_counter() - start
+
+
+def cases():
+    for pen_size in PEN_SIZES:
+        yield f"stroke/pen{pen_size}", bench_stroke, pen_size, 200
+    for size in FILL_SIZES:
+        yield f"fill/{size}", bench_fill, size, max(2000 // size, 4)
+    for length in CHAT_LENGTHS:
+        yield f"chat/{length}", bench_chat, length, 100
+    yield "textbox", bench_textbox, None, 200
+    yield "options_menu", bench_options_menu, None, 50
+    yield "composite", bench_composite, None, 20
+
+
+def run(repeat, only=None):
+    """
+    :return: {case: best milliseconds per frame}
+    """
+    renderer = Renderer(StubClient())
+    # the two boxes the game has, they are on screen in every case
+    height = renderer.font.get_height() + 10
+    TextEntryBox(renderer, (1575, 765, 325, height), default="Guess a word...")
+    TextEntryBox(
+        renderer, (1575, 765 + height + 10, 325, height), blur=True, default="Password"
+    )
+    renderer.present()
+
+    results = {}
+    for name, bench, argument, iterations in cases():
+        if only and not name.startswith(only):
+            continue
+
+        best = None
+        for round_ in range(repeat):
+            rng = random.Random(round_)
+            arguments = (argument,) if argument is not None else ()
+            elapsed = bench(renderer, *arguments, iterations, rng) / iterations
+            best = elapsed if best is None else min(best, elapsed)
+
+        results[name] = best * 1000
+        print(f"{name:16s} {results[name]:9.3f} ms")
+
+    pygame.quit()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: a line for every case slower than allowed
+    """
+    failed = []
+    for name, value in results.items():
+        expected = baseline.get(name)
+        if expected is not None and value > expected * (1 + tolerance):
+            failed.append(
+                f"{name} took {value:.3f} ms, baseline {expected:.3f} ms "
+                f"({value / expected - 1:+.0%})"
+            )
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="only run cases starting with this")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="how much slower than the baseline a case may be, 0.5 is 50%%",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="store these results as the baseline instead of comparing",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.only)
+
+    failed = []
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        baseline.update({name: round(value, 4) for name, value in results.items()})
+
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=4, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            failed = compare(results, json.load(file), args.tolerance)
+
+    else:
+        print(f"No baseline at {args.baseline}, run with --update-baseline first")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"results_ms": results, "failed": failed}, file, indent=4)
+
+    for failure in failed:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
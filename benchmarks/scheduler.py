@@ -0,0 +1,122 @@
+"""
+The server's timer wheel against a heap, with a heartbeat per connection
+
+    python benchmarks/scheduler.py [--connections 10000] [--seconds 60]
+
+Every connection has a heartbeat every 5 seconds and a round timer that keeps being
+cancelled and replaced, like a busy room skipping words. Time is simulated, both are
+advanced tick by tick and must fire the same number of timers.
+"""
+
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"),
+)
+
+from scheduler import TICK, Timer, TimerWheel
+
+HEARTBEAT = 5.0
+ROUND = 120.0
+
+
+def run_wheel(connections, seconds, rng):
+    wheel = TimerWheel(now=0.0)
+    rounds = []
+    for index in range(connections):
+        wheel.add(Timer(rng.uniform(0, HEARTBEAT), None, (), HEARTBEAT))
+        if index % 10 == 0:
+            rounds.append(Timer(ROUND, None, ()))
+            wheel.add(rounds[-1])
+
+    fired = 0
+    worst = 0.0
+    now = 0.0
+    start = time.perf_counter()
+    while now < seconds:
+        now += TICK
+        tick_start = time.perf_counter()
+
+        for timer in wheel.advance(now):
+            fired += 1
+            if timer.interval is not None:
+                timer.when += timer.interval
+                wheel.add(timer)
+
+        # a few rounds skipped every tick
+        for _ in range(5):
+            index = rng.randrange(len(rounds))
+            rounds[index].cancel()
+            rounds[index] = Timer(now + ROUND, None, ())
+            wheel.add(rounds[index])
+
+        worst = max(worst, time.perf_counter() - tick_start)
+
+    return fired, time.perf_counter() - start, worst
+
+
+def run_heap(connections, seconds, rng):
+    heap = []
+    rounds = []
+    for index in range(connections):
+        heapq.heappush(heap, (rng.uniform(0, HEARTBEAT), index, HEARTBEAT, [False]))
+        if index % 10 == 0:
+            rounds.append([False])
+            heapq.heappush(heap, (ROUND, -index, None, rounds[-1]))
+
+    fired = 0
+    worst = 0.0
+    now = 0.0
+    counter = connections
+    start = time.perf_counter()
+    while now < seconds:
+        now += TICK
+        tick_start = time.perf_counter()
+
+        while heap and heap[0][0] <= now:
+            when, key, interval, cancelled = heapq.heappop(heap)
+            if cancelled[0]:
+                continue
+            fired += 1
+            if interval is not None:
+                heapq.heappush(heap, (when + interval, key, interval, cancelled))
+
+        for _ in range(5):
+            index = rng.randrange(len(rounds))
+            rounds[index][0] = True
+            rounds[index] = [False]
+            counter += 1
+            heapq.heappush(heap, (now + ROUND, -counter, None, rounds[index]))
+
+        worst = max(worst, time.perf_counter() - tick_start)
+
+    return fired, time.perf_counter() - start, worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--seconds", type=float, default=60)
+    args = parser.parse_args()
+
+    ticks = round(args.seconds / TICK)
+    results = {}
+    for name, run in (("wheel", run_wheel), ("heap", run_heap)):
+        fired, elapsed, worst = run(args.connections, args.seconds, random.Random(0))
+        results[name] = fired
+        print(
+            f"{name:6s} {fired:8d} fired, {elapsed / ticks * 1e6:7.1f} us per tick,"
+            f" worst tick {worst * 1e6:7.1f} us"
+        )
+
+    assert results["wheel"] == results["heap"], "the wheel and the heap disagree"
+
+
+if __name__ == "__main__":
+    main()
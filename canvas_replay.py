@@ -0,0 +1,217 @@
+import pygame
+
+from history import CanvasHistory
+from raster import flood_fill, rasterize_stroke
+
+# the canvas every player draws on and what it starts as
+CANVAS_SIZE = (1920, 1080)
+CANVAS_BACKGROUND = (232, 252, 255)
+# canvas packets start with who sent them, the server fills it in when relaying them,
+# players send this and so does the server for its own clears
+NO_SENDER = 0
+# what our own canvas events are replayed as, relayed ones go by their sender
+LOCAL = None
+# the biggest pen and fill tolerance anyone draws with, bigger ones are clamped
+MAX_PEN_SIZE = 200
+MAX_TOLERANCE = 255
+
+
+def pack_rgb(rgb) -> int:
+    return int.from_bytes(bytes(rgb[:3]), "big")
+
+
+def unpack_rgb(number: int) -> tuple[int, int, int]:
+    return tuple(number.to_bytes(3, "big"))
+
+
+def checked_fields(opcode: bytes, fields) -> list | None:
+    """
+    Clamps the pen size and tolerance of a canvas packet to what can be drawn
+    :return: the fields, None for a fill outside the canvas
+    """
+    if opcode == b"STBG":
+        sender, tool, rgb, pen_size = fields
+        return [sender, tool, rgb, min(max(pen_size, 1), MAX_PEN_SIZE)]
+
+    elif opcode == b"FILL":
+        sender, x, y, rgb, tolerance = fields
+        if not (0 <= x < CANVAS_SIZE[0] and 0 <= y < CANVAS_SIZE[1]):
+            return None
+        return [sender, x, y, rgb, min(tolerance, MAX_TOLERANCE)]
+
+    return list(fields)
+
+
+def event_from_packet(opcode: bytes, fields) -> tuple[int, tuple] | None:
+    """
+    :return: (sender, canvas event) a STBG, STPT, STEN, FILL, CLER, UNDO or REDO packet
+        carries, None for any other packet
+    """
+    event = _event_from_fields(opcode, fields[1:])
+    return None if event is None else (fields[0], event)
+
+
+def _event_from_fields(opcode: bytes, fields) -> tuple | None:
+    if opcode == b"STBG":
+        tool, rgb, pen_size = fields
+        return "begin", tool, unpack_rgb(rgb), pen_size
+
+    elif opcode == b"STPT":
+        return "points", fields[0]
+
+    elif opcode == b"STEN":
+        return ("end",)
+
+    elif opcode == b"FILL":
+        x, y, rgb, tolerance = fields
+        return "fill", (x, y), unpack_rgb(rgb), tolerance
+
+    elif opcode == b"CLER":
+        return "clear", unpack_rgb(fields[0])
+
+    elif opcode == b"UNDO":
+        return ("undo",)
+
+    elif opcode == b"REDO":
+        return ("redo",)
+
+    return None
+
+
+class CanvasReplay:
+    """
+    Applies canvas events to a canvas, both the drawer and every guesser run their
+    events through this so everyone ends up with exactly the same pixels
+
+    Events are tuples, the first item names the event:
+        ("begin", tool, rgb, pen_size)  start of a stroke
+        ("points", [(x, y), ...])       more points of the current stroke
+        ("end",)                        end of the current stroke
+        ("fill", (x, y), rgb, tolerance)
+        ("clear", rgb)
+        ("undo",)
+        ("redo",)
+    """
+
+    def __init__(self, canvas: pygame.Surface, history: CanvasHistory):
+        self._canvas = canvas
+        self.history = history
+
+        self.tool = None
+        self._rgb = None
+        self._pen_size = None
+        self._last_points = []
+
+    def apply(self, event: tuple) -> pygame.Rect | None:
+        """
+        :return: the area of the canvas that changed, None if nothing did
+        """
+        kind, *args = event
+
+        if kind == "begin":
+            self.tool, self._rgb, pen_size = args
+            # whatever came over the wire, a huge pen would not fit in memory
+            self._pen_size = min(max(int(pen_size), 1), MAX_PEN_SIZE)
+            self._last_points = []
+            return None
+
+        elif kind == "points":
+            if self.tool is None:
+                # points of a stroke whose start we never saw
+                return None
+
+            points = [tuple(point) for point in args[0]]
+            rect = rasterize_stroke(
+                self._canvas, points, self._rgb, self._pen_size, self._last_points
+            )
+            self._last_points = (self._last_points + points)[-2:]
+            self.history.touch(rect)
+            return rect
+
+        elif kind == "end":
+            self.tool = None
+            self.history.commit()
+            return None
+
+        elif kind == "fill":
+            position, rgb, tolerance = args
+            tolerance = min(max(int(tolerance), 0), MAX_TOLERANCE)
+            rect = flood_fill(self._canvas, position, rgb, tolerance)
+
+        elif kind == "clear":
+            # nothing from before a clear can be undone
+            rect = self._canvas.fill(args[0])
+            self.history.reset()
+            return rect
+
+        elif kind == "undo":
+            return self.history.undo()
+
+        elif kind == "redo":
+            return self.history.redo()
+
+        else:
+            raise ValueError(f"Unknown canvas event {kind!r}")
+
+        self.history.touch(rect)
+        self.history.commit()
+        return rect
+
+
+class SharedCanvas:
+    """
+    A canvas everyone in the room draws on, each sender's canvas events go through a
+    CanvasReplay and CanvasHistory of their own. Strokes drawn at the same time never
+    mix and an UNDO only takes back what its sender drew.
+
+    The histories share one committed copy of the canvas. A clear empties all of them,
+    the replays of other senders are dropped then unless they are halfway through a stroke.
+    """
+
+    def __init__(self, canvas: pygame.Surface, budget: int):
+        """
+        :param budget: bytes of undo steps kept for each sender
+        """
+        self._canvas = canvas
+        self._budget = budget
+        self._replays = {
+            LOCAL: CanvasReplay(canvas, CanvasHistory(canvas, budget=budget))
+        }
+
+    def close(self):
+        for replay in self._replays.values():
+            replay.history.close()
+        self._replays.clear()
+
+    def history(self, sender=LOCAL) -> CanvasHistory:
+        return self._replay(sender).history
+
+    def apply(self, event: tuple, sender=LOCAL) -> pygame.Rect | None:
+        """
+        :return: the area of the canvas that changed, None if nothing did
+        """
+        rect = self._replay(sender).apply(event)
+
+        if event[0] == "clear":
+            # the sender's own history was emptied by its replay
+            for other, replay in list(self._replays.items()):
+                if other == sender:
+                    continue
+                if other is not LOCAL and replay.tool is None:
+                    del self._replays[other]
+                    replay.history.close()
+                else:
+                    replay.history.reset()
+
+        return rect
+
+    def _replay(self, sender) -> CanvasReplay:
+        replay = self._replays.get(sender)
+        if replay is None:
+            history = CanvasHistory(
+                self._canvas,
+                budget=self._budget,
+                shares_with=self._replays[LOCAL].history,
+            )
+            replay = self._replays[sender] = CanvasReplay(self._canvas, history)
+        return replay
@@ -1,9 +1,33 @@
 import threading
+import selectors
 import socket
 import time
+from collections import deque
+
+import protocol
+from canvas_replay import NO_SENDER, event_from_packet, pack_rgb
+from clock_sync import ClockSync
+from frame_codec import FrameEncoder
 
 
 WELCOME_MESSAGE = "Welcome to the game! Have fun!"
+# seconds between our pings, keeps the round trip time and clock offset current
+PING_INTERVAL = 2
+FRAME_INTERVAL = 1 / 24
+# packets that change what the renderer draws, the rest it does not need waking for
+SHOWN_PACKETS = {
+    b"CHAT",
+    b"WORD",
+    b"LOBY",
+    b"ROND",
+    b"STBG",
+    b"STPT",
+    b"STEN",
+    b"FILL",
+    b"CLER",
+    b"UNDO",
+    b"REDO",
+}
 
 
 class BadClientConfig(Exception):
@@ -11,28 +35,72 @@ class BadClientConfig(Exception):
 
 
 class Client(threading.Thread):
-    def __init__(self, address: tuple[str, int], name: str, frame_func = None):
+    """
+    The connection to the server, run on a thread of its own
+
+    That thread is the only one touching the socket. It waits on a selector for data
+    from the server, room to write, a wake up from another thread or the next ping or
+    frame being due. Anyone may call _send, which only queues the encoded packet and
+    wakes the thread, so packets from different threads can never interleave.
+    """
+
+    def __init__(
+        self, address: tuple[str, int], name: str, frame_func=None, room: str = ""
+    ):
         super(Client, self).__init__()
         self._running = True
         self._operable = False
 
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.connect(address)
-
+        self._address = address
+        self._socket = self._connect(address)
+        self._parser = protocol.PacketParser()
+        self._bytes_received = 0
+        self.bytes_sent = 0
+
+        # encoded packets waiting for the socket, filled by anyone, emptied by run()
+        self._unsent = bytearray()
+        self._unsent_lock = threading.Lock()
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._wake_reader.setblocking(False)
+        self._wake_writer.setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._wake_reader, selectors.EVENT_READ)
+        self._selector.register(self._socket, selectors.EVENT_READ)
+        self._events = selectors.EVENT_READ
+        self.clock = ClockSync()
+        self._next_ping = 0
+
+        # returns the canvas as (height, width) 0xRRGGBB pixels, see frame_codec
         self._frame_func = frame_func
         self._name = name
+        # blank joins the server's default room
+        self._room = room
         self._chat = [WELCOME_MESSAGE]
         self._lobby_clients = []
+        # strokes, fills and clears from other players, drained by the renderer
+        self._canvas_events = deque()
+        # called from this thread whenever something arrived the renderer shows
+        self.on_update = None
 
         self._word_pattern = None
+        # server time the current round ends, None outside of a round
+        self._round_end = None
         self._time_since_last_frame = time.time()
         self._frame_sending_signaling = 0
+        self._frame_encoder = FrameEncoder()
 
     def request_word_skip(self):
-        self._socket.send(b"SKIP")
+        self._send(b"SKIP")
 
     def request_game_start(self):
-        self._socket.send(b"STRT")
+        self._send(b"STRT")
+
+    def request_word_removal(self):
+        self._send(b"WDEL")
+
+    def suggest_word(self, word):
+        self._send(b"WADD", word)
 
     @property
     def word_pattern(self):
@@ -49,75 +117,180 @@ class Client(threading.Thread):
     def in_lobby(self):
         return self._lobby_clients
 
-    def process_packet(self, packet):
+    @property
+    def bytes_received(self):
+        return self._bytes_received
+
+    @property
+    def rtt(self):
+        """
+        :return: smoothed round trip time to the server in seconds, None until measured
+        """
+        return self.clock.rtt
+
+    @property
+    def round_end(self):
+        """
+        :return: when the round ends as a time.time() on our clock, None outside a round
+        """
+        if self._round_end is None:
+            return None
+
+        return self.clock.our_time(self._round_end)
+
+    @property
+    def has_canvas_events(self):
+        return bool(self._canvas_events)
+
+    def canvas_events(self):
+        while self._canvas_events:
+            yield self._canvas_events.popleft()
+
+    def process_packet(self, packet, fields):
+        self._handle_packet(packet, fields)
+
+        if packet in SHOWN_PACKETS and self.on_update is not None:
+            self.on_update()
+
+    def _handle_packet(self, packet, fields):
         if packet == b"PING":
-            self._socket.send(b"PONG")
+            self._send(b"PONG", fields[0], time.time())
 
-        elif packet == b"LOBY":
-            len_clients = self._read_int_secure()
-            clients = []
+        elif packet == b"PONG":
+            self.clock.pong(*fields)
 
-            for _ in range(len_clients):
-                clients.append(self._read_string_secure())
+        elif packet == b"ROND":
+            self._round_end = fields[0]
 
-            self._lobby_clients = clients
+        elif packet == b"LOBY":
+            self._lobby_clients = fields[0]
 
         elif packet == b"CHAT":
-            message = self._read_string_secure()
+            message = fields[0]
             print(f" [ \033[34mClient\033[0m ] Received chat message '{message}'")
 
             self._chat.append(message.strip())
             print(f" [ \033[34mClient\033[0m ] Chat log '{self._chat}'")
 
         elif packet == b"WORD":
-            self._word_pattern = self._read_string_secure()
+            self._word_pattern = fields[0]
+
+        elif packet == b"MOVE":
+            self._move(fields[0])
+
+        elif (event := event_from_packet(packet, fields)) is not None:
+            # (sender, event), replayed through the sender's own history
+            self._canvas_events.append(event)
 
         else:
             print(f" [ \033[34mClient\033[0m ] Bad packet received", packet)
 
+    @staticmethod
+    def _connect(address):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.connect(address)
+        sock.setblocking(False)
+        return sock
+
+    def _move(self, port):
+        # Our room is run by another server process on the same host
+        self._address = (self._address[0], port)
+        print(f" [ \033[34mClient\033[0m ] Moving to port {port}")
+
+        sock = self._connect(self._address)
+
+        self._selector.unregister(self._socket)
+        self._socket.close()
+        self._socket = sock
+        self._parser = protocol.PacketParser()
+        self._selector.register(sock, selectors.EVENT_READ)
+        self._events = selectors.EVENT_READ
+
+        with self._unsent_lock:
+            # whatever was meant for the old server is of no use to the new one
+            self._unsent.clear()
+        self.send_initial()
+
     def close(self):
         self._running = False
+        self._wake()
         print(f" [ \033[34mClient\033[0m ] Closing server")
 
     def send_message(self, word):
         print(f" [ \033[34mClient\033[0m ] Sending chat message '{word}'")
 
-        self._socket.send(b"WORD")
-        self._send_string_secure(word)
+        self._send(b"WORD", word)
+
+    def send_canvas_event(self, event):
+        kind, *args = event
+
+        if kind == "begin":
+            tool, rgb, pen_size = args
+            self._send(b"STBG", NO_SENDER, tool, pack_rgb(rgb), pen_size)
+
+        elif kind == "points":
+            self._send(b"STPT", NO_SENDER, args[0])
+
+        elif kind == "end":
+            self._send(b"STEN", NO_SENDER)
+
+        elif kind == "fill":
+            position, rgb, tolerance = args
+            self._send(b"FILL", NO_SENDER, *position, pack_rgb(rgb), tolerance)
+
+        elif kind == "clear":
+            self._send(b"CLER", NO_SENDER, pack_rgb(args[0]))
+
+        elif kind == "undo":
+            self._send(b"UNDO", NO_SENDER)
+
+        elif kind == "redo":
+            self._send(b"REDO", NO_SENDER)
 
     def wait_till_success(self, query_time=0.5):
         while not self._operable:
             time.sleep(query_time)
 
-    def _send_string_secure(self, string: str):
-        self._socket.send(len(string).to_bytes(2, "big"))
-        self._socket.send(string.encode())
+    def _send(self, packet, *fields):
+        # queued whole under the lock, the network thread writes it out
+        data = protocol.encode(packet, *fields)
 
-    def _read_string_secure(self):
-        length = self._socket.recv(2)
-        length = int.from_bytes(length, "big")
+        with self._unsent_lock:
+            was_empty = not self._unsent
+            self._unsent += data
 
-        data = self._socket.recv(length)
-        return data.decode()
+        if was_empty:
+            self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_writer.send(b"\0")
+        except (BlockingIOError, OSError):
+            # already plenty of wake ups waiting, or closed
+            ...
 
     def send_initial(self):
         if not (4 <= len(self.name) <= 10):
             raise BadClientConfig("Bad name length")
 
-        self._socket.send(b"JOIN")
-        self._send_string_secure(self.name)
-
-    def _send_int_secure(self, number: int):
-        self._socket.send(number.to_bytes(4, "big"))
+        self._send(b"JOIN", self.name, self._room)
 
-    def _read_int_secure(self):
-        data = self._socket.recv(4)
-        data = int.from_bytes(data, "big")
-        return data
+    def _send_frame(self, frame):
+        self._send(b"FRME", self._frame_encoder.encode(frame))
 
-    def _send_frame(self):
-        self._socket.send(b"FRME")
+    def _ping_check(self):
+        now = time.time()
+        if now >= self._next_ping:
+            self._next_ping = now + PING_INTERVAL
+            self._send(b"PING", now)
 
+    def _next_deadline(self):
+        # the next time a ping or a frame is due, the selector waits no longer than that
+        deadline = self._next_ping
+        if self._frame_sending_signaling >= time.time():
+            deadline = min(deadline, self._time_since_last_frame + FRAME_INTERVAL)
+        return deadline
 
     def _frame_send_check(self):
         current_time = time.time()
@@ -125,7 +298,7 @@ class Client(threading.Thread):
         if self._frame_sending_signaling < current_time:
             return
 
-        if self._time_since_last_frame + 1 / 24 > current_time:
+        if self._time_since_last_frame + FRAME_INTERVAL > current_time:
             return
 
         if self._frame_func is None:
@@ -133,26 +306,76 @@ class Client(threading.Thread):
             return
 
         self._time_since_last_frame = current_time
-        frame = self._frame_func()
+        self._send_frame(self._frame_func())
+
+    def _receive(self):
+        try:
+            data = self._socket.recv(65536)
+        except BlockingIOError:
+            return
+        if not data:
+            raise ConnectionResetError("Connection closed by the other side")
+
+        self._bytes_received += len(data)
+        parser = self._parser
+        parser.feed(data)
 
-        self._socket.send(len(frame).to_bytes(2, "big"))
-        self._socket.send(frame)
+        # a MOVE swaps the parser, anything after it in this one was for the old server
+        while parser is self._parser and (packet := parser.next_packet()) is not None:
+            self.process_packet(*packet)
+
+    def _write(self):
+        with self._unsent_lock:
+            try:
+                sent = self._socket.send(self._unsent)
+            except BlockingIOError:
+                return
+            del self._unsent[:sent]
+            self.bytes_sent += sent
+
+    def _poll(self, timeout):
+        # write interest only while something is waiting, else select returns at once
+        with self._unsent_lock:
+            events = selectors.EVENT_READ | (
+                selectors.EVENT_WRITE if self._unsent else 0
+            )
+        if events != self._events:
+            self._selector.modify(self._socket, events)
+            self._events = events
+
+        for key, mask in self._selector.select(max(timeout, 0)):
+            if key.fileobj is self._wake_reader:
+                try:
+                    while self._wake_reader.recv(4096):
+                        ...
+                except BlockingIOError:
+                    ...
+                continue
+
+            if mask & selectors.EVENT_READ:
+                self._receive()
+            if mask & selectors.EVENT_WRITE and key.fileobj is self._socket:
+                self._write()
 
     def run(self) -> None:
         self.send_initial()
         self._operable = True
 
-        while self._running:
-            self._socket.settimeout(1/24)
-
+        try:
+            while self._running:
+                self._poll(self._next_deadline() - time.time())
+                self._ping_check()
+                self._frame_send_check()
+        except (ConnectionError, protocol.ProtocolError) as error:
+            print(f" [ \033[34mClient\033[0m ] Lost the server: {error}")
+            self._running = False
+        finally:
+            # whatever is still queued gets one go at leaving
             try:
-                data = self._socket.recv(4)
-            except socket.timeout:
+                self._write()
+            except OSError:
                 ...
-            else:
-                self._socket.settimeout(None)
-                self.process_packet(data)
-            finally:
-                self._socket.settimeout(None)
-
-            self._frame_send_check()
\ No newline at end of file
+            self._selector.close()
+            self._socket.close()
+            self._wake_reader.close()
+            self._wake_writer.close()
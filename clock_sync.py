@@ -0,0 +1,51 @@
+import time
+from collections import deque
+
+RTT_SMOOTHING = 1 / 8
+
+
+class ClockSync:
+    """
+    Round trip time to the other end of a connection and how far its clock is off
+    from ours, worked out from PING and PONG
+
+    A PONG carries the time its PING was sent and the time the other side replied.
+    Assuming the trip took as long both ways, their clock read that time halfway
+    through the round trip. The quickest of the last few round trips was the least
+    held up along the way, its offset is the one used.
+    """
+
+    def __init__(self, samples: int = 8):
+        # smoothed, seconds, None until the first PONG
+        self.rtt: float | None = None
+        # seconds to add to our clock to get theirs
+        self.offset = 0.0
+        self._samples: deque[tuple[float, float]] = deque(maxlen=samples)
+
+    def pong(
+        self, sent_at: float, their_time: float, received_at: float | None = None
+    ) -> float:
+        """
+        :param sent_at: our time the PING went out, echoed back in the PONG
+        :param their_time: their time when they replied
+        :param received_at: our time the PONG arrived, now if not given
+        :return: the round trip time of this PING
+        """
+        if received_at is None:
+            received_at = time.time()
+
+        rtt = max(received_at - sent_at, 0.0)
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt += (rtt - self.rtt) * RTT_SMOOTHING
+
+        self._samples.append((rtt, their_time - (sent_at + received_at) / 2))
+        self.offset = min(self._samples)[1]
+        return rtt
+
+    def their_time(self, our_time: float | None = None) -> float:
+        return (time.time() if our_time is None else our_time) + self.offset
+
+    def our_time(self, their_time: float) -> float:
+        return their_time - self.offset
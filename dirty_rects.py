@@ -0,0 +1,54 @@
+import pygame
+
+
+class DirtyRects:
+    """
+    Collects the areas of the screen that changed since the last frame
+    """
+
+    def __init__(self, bounds: tuple[int, int, int, int], max_rects: int = 16):
+        self._bounds = pygame.Rect(bounds)
+        self._max_rects = max_rects
+        self._rects: list[pygame.Rect] = []
+
+    def __bool__(self):
+        return bool(self._rects)
+
+    def add(self, rect):
+        """
+        Marks an area as changed, anything outside the screen is ignored
+        :param rect: anything pygame.Rect accepts, None is ignored
+        """
+        if rect is None:
+            return
+
+        rect = self._bounds.clip(rect)
+
+        if rect.width and rect.height:
+            self._rects.append(rect)
+
+    def add_all(self):
+        self._rects = [self._bounds.copy()]
+
+    def flush(self) -> list[pygame.Rect]:
+        """
+        Merges overlapping areas and resets the tracker
+        :return: the areas to redraw and push to the display
+        """
+        merged = []
+
+        for rect in self._rects:
+            overlap = rect.collidelist(merged)
+
+            while overlap != -1:
+                rect.union_ip(merged.pop(overlap))
+                overlap = rect.collidelist(merged)
+
+            merged.append(rect)
+
+        # past a point redrawing a bit too much is cheaper than many small updates
+        if len(merged) > self._max_rects:
+            merged = [merged[0].unionall(merged[1:])]
+
+        self._rects = []
+        return merged
@@ -0,0 +1,133 @@
+import struct
+import zlib
+
+import numpy
+
+# flags, width, height, tile size, number of tiles
+HEADER = struct.Struct(">BHHHI")
+# tile x, tile y, compressed length
+TILE_HEADER = struct.Struct(">HHI")
+
+KEYFRAME = 0x01
+
+
+class FrameEncoder:
+    """
+    Encodes canvas frames as the zlib compressed tiles that changed since the last frame,
+    every so often a keyframe carrying every tile is sent instead
+
+    Frames go in as (height, width) uint32 arrays of 0xRRGGBB pixels, comparing whole
+    pixels is far cheaper than comparing channels. Tiles are sent as RGB.
+    """
+
+    def __init__(
+        self, tile_size: int = 64, keyframe_interval: int = 48, level: int = 1
+    ):
+        """
+        :param tile_size: width and height of a tile in pixels
+        :param keyframe_interval: frames between keyframes, at 24 fps 48 is every 2 seconds
+        :param level: zlib compression level
+        """
+        self._tile_size = tile_size
+        self._keyframe_interval = keyframe_interval
+        self._level = level
+
+        self._previous = None
+        self._since_keyframe = 0
+
+    def force_keyframe(self):
+        self._previous = None
+
+    def encode(self, frame: numpy.ndarray) -> bytes:
+        """
+        :param frame: the canvas, pygame.surfarray.pixels2d(canvas).T for a 32 bit canvas
+        :return: the payload of a FRME packet
+        """
+        # a private contiguous copy, it becomes the reference for the next frame
+        frame = numpy.array(frame, dtype=numpy.uint32, order="C")
+        height, width = frame.shape
+        size = self._tile_size
+        tiles_y, tiles_x = -(-height // size), -(-width // size)
+
+        keyframe = (
+            self._previous is None
+            or self._previous.shape != frame.shape
+            or self._since_keyframe >= self._keyframe_interval
+        )
+
+        if keyframe:
+            changed = numpy.ones((tiles_y, tiles_x), dtype=bool)
+            self._since_keyframe = 0
+        else:
+            changed = _changed_tiles(self._previous, frame, size)
+            self._since_keyframe += 1
+
+        parts = []
+        for tile_y, tile_x in zip(*numpy.nonzero(changed)):
+            tile = frame[
+                tile_y * size : (tile_y + 1) * size, tile_x * size : (tile_x + 1) * size
+            ]
+            data = zlib.compress(_to_rgb(tile).tobytes(), self._level)
+            parts.append(TILE_HEADER.pack(tile_x, tile_y, len(data)))
+            parts.append(data)
+
+        self._previous = frame
+
+        header = HEADER.pack(
+            KEYFRAME if keyframe else 0, width, height, size, len(parts) // 2
+        )
+        return header + b"".join(parts)
+
+
+class FrameDecoder:
+    """
+    Rebuilds frames from the output of a FrameEncoder as (height, width, 3) RGB arrays
+    """
+
+    def __init__(self):
+        self.frame: numpy.ndarray | None = None
+
+    def decode(self, payload: bytes) -> numpy.ndarray:
+        """
+        :return: the full frame after applying payload, do not modify it
+        :raises ValueError: if the payload is a delta and no keyframe was seen yet
+        """
+        flags, width, height, size, tile_count = HEADER.unpack_from(payload)
+        offset = HEADER.size
+
+        if (
+            flags & KEYFRAME
+            or self.frame is None
+            or self.frame.shape[:2] != (height, width)
+        ):
+            if not flags & KEYFRAME:
+                raise ValueError("Received a delta frame before any keyframe")
+            self.frame = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+
+        for _ in range(tile_count):
+            tile_x, tile_y, length = TILE_HEADER.unpack_from(payload, offset)
+            offset += TILE_HEADER.size
+
+            area = self.frame[
+                tile_y * size : (tile_y + 1) * size, tile_x * size : (tile_x + 1) * size
+            ]
+            data = zlib.decompress(payload[offset : offset + length])
+            area[...] = numpy.frombuffer(data, dtype=numpy.uint8).reshape(area.shape)
+            offset += length
+
+        return self.frame
+
+
+def _to_rgb(pixels: numpy.ndarray) -> numpy.ndarray:
+    return numpy.stack(
+        ((pixels >> 16) & 0xFF, (pixels >> 8) & 0xFF, pixels & 0xFF), axis=-1
+    ).astype(numpy.uint8)
+
+
+def _changed_tiles(previous: numpy.ndarray, frame: numpy.ndarray, size: int):
+    # (tiles_y, tiles_x) mask of tiles with any differing pixel
+    height, width = frame.shape
+    changed = previous != frame
+
+    columns = numpy.logical_or.reduceat(changed, numpy.arange(0, width, size), axis=1)
+    return numpy.logical_or.reduceat(columns, numpy.arange(0, height, size), axis=0)
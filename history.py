@@ -0,0 +1,237 @@
+import queue
+import threading
+import zlib
+from collections import deque
+
+import numpy
+import pygame
+
+
+class CanvasHistory:
+    """
+    Undo / redo for a canvas surface, storing only the tiles each action changed
+
+    A copy of the canvas as of the last committed action is kept, when an action is
+    committed the old contents of every tile it touched are moved into the history.
+    Stored tiles get zlib compressed on a background thread.
+    """
+
+    def __init__(
+        self,
+        canvas: pygame.Surface,
+        tile_size: int = 64,
+        budget: int = 64 * 1024 * 1024,
+        shares_with: "CanvasHistory | None" = None,
+    ):
+        """
+        :param canvas: surface to track, every change to it must be reported with touch()
+        :param tile_size: width and height of a tile in pixels
+        :param budget: maximum bytes of tile data kept, oldest actions are forgotten first
+        :param shares_with: another history of the same canvas, e.g. for someone else's
+            drawing. Both keep one copy of the committed canvas, so neither takes what
+            the other committed for its own and undoes it.
+        """
+        self._canvas = canvas
+        self._tile_size = tile_size
+        self._budget = budget
+
+        if shares_with is None:
+            self._committed = pygame.surfarray.array2d(canvas)
+        else:
+            self._committed = shares_with._committed
+        self._touched: set[tuple[int, int]] = set()
+
+        # each action is a dict of tile -> (data, is_compressed)
+        self._undo: deque[dict] = deque()
+        self._redo: list[dict] = []
+        self._size = 0
+
+        self._lock = threading.Lock()
+        self._to_compress: queue.Queue[dict] = queue.Queue()
+        threading.Thread(target=self._compressor, daemon=True).start()
+
+    @property
+    def size(self) -> int:
+        """
+        Bytes of tile data currently held by the history
+        """
+        return self._size
+
+    def can_undo(self) -> bool:
+        return bool(self._undo) or bool(self._touched)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def touch(self, rect):
+        """
+        Reports an area of the canvas that was (or is about to be) drawn to
+        """
+        if rect is None:
+            return
+
+        rect = self._canvas.get_rect().clip(rect)
+        if not (rect.width and rect.height):
+            return
+
+        size = self._tile_size
+        self._touched.update(
+            (x, y)
+            for x in range(rect.left // size, (rect.right - 1) // size + 1)
+            for y in range(rect.top // size, (rect.bottom - 1) // size + 1)
+        )
+
+    def commit(self):
+        """
+        Ends the current action, everything touched since the last commit undoes together
+        """
+        if not self._touched:
+            return
+
+        pixels = pygame.surfarray.pixels2d(self._canvas)
+        action = {}
+
+        for tile in self._touched:
+            area = self._tile_slice(tile)
+            before = self._committed[area]
+
+            if numpy.array_equal(before, pixels[area]):
+                continue
+
+            action[tile] = (before.tobytes(), False)
+            self._committed[area] = pixels[area]
+
+        del pixels
+        self._touched.clear()
+
+        if not action:
+            return
+
+        with self._lock:
+            for forgotten in self._redo:
+                self._forget(forgotten)
+            self._redo.clear()
+            self._undo.append(action)
+            self._size += self._action_size(action)
+            self._evict()
+
+        self._to_compress.put(action)
+
+    def close(self):
+        """
+        Stops the compressor thread, for when the history is no longer needed
+        """
+        self._to_compress.put(None)
+
+    def reset(self):
+        """
+        Forgets every action, for when the whole canvas was replaced. The canvas as it is
+        now becomes the committed copy, for the histories sharing it as well.
+        """
+        with self._lock:
+            for action in (*self._undo, *self._redo):
+                self._forget(action)
+            self._undo.clear()
+            self._redo.clear()
+
+        self._touched.clear()
+        pixels = pygame.surfarray.pixels2d(self._canvas)
+        self._committed[...] = pixels
+        del pixels
+
+    def undo(self) -> pygame.Rect | None:
+        """
+        :return: the area of the canvas that changed, None if there was nothing to undo
+        """
+        self.commit()
+        return self._swap(self._undo, self._redo)
+
+    def redo(self) -> pygame.Rect | None:
+        """
+        :return: the area of the canvas that changed, None if there was nothing to redo
+        """
+        self.commit()
+        return self._swap(self._redo, self._undo)
+
+    def _swap(self, source, destination) -> pygame.Rect | None:
+        # Restores the newest action of source, storing what it replaced in destination
+        with self._lock:
+            if not source:
+                return None
+
+            action = source.pop()
+            self._size -= self._action_size(action)
+            restore = {
+                tile: self._decode(tile, *stored) for tile, stored in action.items()
+            }
+            action.clear()
+
+        pixels = pygame.surfarray.pixels2d(self._canvas)
+        replaced = {}
+        changed = None
+
+        for tile, data in restore.items():
+            area = self._tile_slice(tile)
+            # everything is committed at this point, no need to read back from the surface
+            replaced[tile] = (self._committed[area].tobytes(), False)
+            pixels[area] = data
+            self._committed[area] = data
+
+            rect = pygame.Rect(area[0].start, area[1].start, *data.shape)
+            changed = rect if changed is None else changed.union(rect)
+
+        del pixels
+
+        with self._lock:
+            destination.append(replaced)
+            self._size += self._action_size(replaced)
+            self._evict()
+
+        self._to_compress.put(replaced)
+        return changed
+
+    def _tile_slice(self, tile) -> tuple[slice, slice]:
+        width, height = self._canvas.get_size()
+        x, y = tile[0] * self._tile_size, tile[1] * self._tile_size
+        return (
+            slice(x, min(x + self._tile_size, width)),
+            slice(y, min(y + self._tile_size, height)),
+        )
+
+    def _decode(self, tile, data: bytes, compressed: bool) -> numpy.ndarray:
+        area = self._tile_slice(tile)
+        shape = (area[0].stop - area[0].start, area[1].stop - area[1].start)
+
+        if compressed:
+            data = zlib.decompress(data)
+
+        return numpy.frombuffer(data, dtype=self._committed.dtype).reshape(shape)
+
+    @staticmethod
+    def _action_size(action: dict) -> int:
+        return sum(len(data) for data, _ in action.values())
+
+    def _forget(self, action: dict):
+        # caller holds the lock, clearing tells the compressor not to bother
+        self._size -= self._action_size(action)
+        action.clear()
+
+    def _evict(self):
+        # caller holds the lock, the action just recorded is always kept
+        while self._size > self._budget and len(self._undo) > 1:
+            self._forget(self._undo.popleft())
+
+    def _compressor(self):
+        while (action := self._to_compress.get()) is not None:
+            for tile, stored in list(action.items()):
+                data, compressed = stored
+                if compressed:
+                    continue
+
+                packed = zlib.compress(data, 1)
+
+                with self._lock:
+                    # the action might have been undone or forgotten in the meantime
+                    if action.get(tile) is stored:
+                        action[tile] = (packed, True)
+                        self._size += len(packed) - len(data)
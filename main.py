@@ -5,6 +5,10 @@ import sys
 import math
 from utilities import *
 from client import *
+from text_cache import TextCache
+from dirty_rects import DirtyRects
+from canvas_replay import SharedCanvas
+from stroke_capture import StrokeCapture
 import io
 
 RED = (255, 0, 0)
@@ -16,62 +20,17 @@ GRAY, SLIGHTLY_DARKER_GRAY, SLIGHTLY_DARKER_DARKER_GRAY = (
     (180, 180, 180),
 )
 BLACK = (0, 0, 0)
-INTERPOLATE_STEP = 20
+CHAT_AREA = pygame.Rect(1580, 20, 320, 745)
+# posted from the network thread when something arrived that changes the screen
+NETWORK_UPDATE = pygame.event.custom_type()
+# longest an idle frame waits, in case a wake up got lost
+IDLE_WAIT = 1.0
 
 entryboxes = []
 important_keys = [K_RETURN, K_KP_ENTER, K_BACKSPACE, K_LEFT, K_RIGHT]
 arrow_keys = [K_LEFT, K_RIGHT]
 
 
-def draw_line_interpolated_1(points, screen, rgb, line_width):
-    true = (
-        (points[-1][0] - points[-2][0]) ** 2 + (points[-1][1] - points[-2][1]) ** 2
-    ) ** 0.5
-    projected = (
-        (points[-2][0] - points[-3][0]) ** 2 + (points[-2][1] - points[-3][1]) ** 2
-    ) ** 0.5
-    final = min(projected, true * 0.3)
-
-    projection = (
-        int(points[-2][0] - ((final / projected) * (points[-3][0] - points[-2][0]))),
-        int(points[-2][1] - ((final / projected) * (points[-3][1] - points[-2][1]))),
-    )
-
-    interpolate_points = points[-2:]
-
-    interpolate_points.insert(1, projection)
-
-    prev = (
-        interpolate(
-            interpolate(interpolate_points[0], interpolate_points[1], 0),
-            interpolate(interpolate_points[1], interpolate_points[2], 0),
-            0,
-        ),
-    )
-
-    for i in range(INTERPOLATE_STEP):
-        new = (
-            interpolate(
-                interpolate(
-                    interpolate_points[0], interpolate_points[1], (i / INTERPOLATE_STEP)
-                ),
-                interpolate(
-                    interpolate_points[1], interpolate_points[2], (i / INTERPOLATE_STEP)
-                ),
-                (i / INTERPOLATE_STEP),
-            ),
-        )
-
-        pygame.draw.line(screen, rgb, prev, new, line_width)
-        pygame.draw.circle(screen, rgb, prev, line_width // 2)
-        pygame.draw.circle(screen, rgb, new, line_width // 2)
-
-        prev = new
-
-    pygame.draw.line(screen, rgb, points[-2], prev, line_width)
-    pygame.draw.circle(screen, rgb, prev, line_width // 2)
-
-
 class Renderer:
     def __init__(self, client):
         pygame.init()
@@ -80,23 +39,32 @@ class Renderer:
         self.server: Client = client
         self.screen = pygame.display.set_mode((1920, 1080))
         self.font = pygame.font.FontType("resources/consola.ttf", 18)
+        # shared with the text boxes, most strings on screen barely ever change
+        self.text = TextCache(self.font)
+        self.__chat = ChatLayout(max_lines=27, max_length=30)
         self.__running = True
         self.__is_drawing = True
         self.__is_guessing = False
         self.__is_spectating = False
         # List of tools 'Drawing', 'Rubber', 'Fill' and more to come :)
         self.__current_tool = "Drawing"
-        self.__past_drawing_points = []
         self.__current_tool_active = False
         self.__pen_size = 5
         self.__current_RGB = (0, 0, 0)
         self.__last_draw_pos = (0, 0)
+        self.__stroke = StrokeCapture()
         self.__canvas = pygame.Surface((1920, 1080))
         self.__canvas.fill(CANVAS_BACKGROUND)
+        # Our strokes and everyone else's are replayed the same way so they match
+        # exactly, but each sender has their own history: nobody's strokes end up in
+        # our undo steps and an UNDO only takes back what its sender drew
+        self.__shared_canvas = SharedCanvas(
+            self.__canvas, budget=settings["UndoBudgetMB"] * 1024 * 1024
+        )
+        self.__history = self.__shared_canvas.history()
         self.clock = pygame.time.Clock()
         self.__options_menu_open = False
         self.__settings_pos = (0, 0)
-        self.__round_end = time.time() + 120
         self.__skip_current_word = pygame.Surface((100, 50), pygame.SRCALPHA)
         self.__skip_current_word.fill((0, 0, 0, 0))
         self.__editing_text = False
@@ -111,18 +79,96 @@ class Renderer:
             i = pygame.transform.scale(i, (32, 32))
             self.images[image] = i
 
+        # Only the areas that changed get redrawn and pushed to the display,
+        # redrawing everything every frame is kept around to compare against
+        self.__full_redraw = settings["FullRedraw"]
+        self.__dirty = DirtyRects(self.screen.get_rect())
+        self.__dirty.add_all()
+        self.__timer_text = ""
+        self.__timer_rect = None
+        self.__menu_drawn_at = None
+        self.__start_button_shown = False
+
+        # With nothing moving on screen the loop sleeps until there is input, news from
+        # the server or the timer is about to tick, instead of drawing at full rate
+        self.__adaptive_fps = settings["AdaptiveFps"]
+        self.__update_posted = False
+        self.frames_skipped = 0
+        self.server.on_update = self.wake
+
+    def wake(self):
+        # called from the network thread, pygame's event queue is safe to post to
+        if not self.__update_posted:
+            self.__update_posted = True
+            pygame.event.post(pygame.event.Event(NETWORK_UPDATE))
+
+    def _is_idle(self):
+        return not (
+            self.__current_tool_active or self.__dirty or self.server.has_canvas_events
+        )
+
+    def _idle_timeout(self):
+        # until the next time something on screen changes by itself
+        now = time.time()
+        timeout = IDLE_WAIT
+
+        round_end = self.server.round_end
+        if round_end is not None and round_end > now:
+            timeout = min(timeout, (round_end - now) % 1)
+
+        if any(box.writing for box in entryboxes):
+            # the cursor blinks every half second
+            timeout = min(timeout, 0.5 - now % 0.5)
+
+        # a millisecond over, so the wait ends just after the change rather than before
+        return timeout + 0.001
+
+    def _events(self):
+        events = pygame.event.get()
+        if events or not self.__adaptive_fps or not self._is_idle():
+            return events
+
+        started = time.perf_counter()
+        event = pygame.event.wait(int(self._idle_timeout() * 1000))
+        self.frames_skipped += int((time.perf_counter() - started) * settings["MaxFps"])
+
+        if event.type == pygame.NOEVENT:
+            return []
+        return [event] + pygame.event.get()
+
     def render_loop(self):
         while self.__running:
+            events = self._events()
             mouse_pos = pygame.mouse.get_pos()
-            for event in pygame.event.get():
+            for event in events:
                 if event.type == pygame.QUIT:
                     self.__running = False
+
+                elif event.type == NETWORK_UPDATE:
+                    self.__update_posted = False
                 # Event checks:
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_h:
-                        pygame.draw.rect(
-                            self.__canvas, self.__current_RGB, (100, 100, 100, 100), 4
+                        self._canvas_changed(
+                            pygame.draw.rect(
+                                self.__canvas,
+                                self.__current_RGB,
+                                (100, 100, 100, 100),
+                                4,
+                            )
                         )
+                        self.__history.commit()
+
+                    if event.mod & KMOD_CTRL:
+                        if event.key == K_z and event.mod & KMOD_SHIFT:
+                            self.redo()
+                            continue
+                        elif event.key == K_z:
+                            self.undo()
+                            continue
+                        elif event.key == K_y:
+                            self.redo()
+                            continue
 
                     for box in entryboxes:
                         if box.writing:
@@ -164,10 +210,14 @@ class Renderer:
                             elif self.__current_tool == "Drawing":
                                 self.__current_tool_active = True
                                 self.__last_draw_pos = mouse_pos
+                                self.begin_stroke(self.__current_RGB)
+                                self.__stroke.begin(event.pos)
 
                             elif self.__current_tool == "Rubber":
                                 self.__current_tool_active = True
                                 self.__last_draw_pos = mouse_pos
+                                self.begin_stroke(CANVAS_BACKGROUND)
+                                self.__stroke.begin(event.pos)
 
                             
                             
@@ -178,36 +228,121 @@ class Renderer:
                         self.__settings_pos = (mouse_pos[0] - 200, mouse_pos[1] - 200)
                         self.__options_menu_open = True
 
+                elif event.type == MOUSEMOTION:
+                    # every queued position, not just where the mouse is this frame
+                    if self.__current_tool_active:
+                        self.__stroke.add(event.pos)
+
                 elif event.type == MOUSEBUTTONUP:
                     if event.button == 1:
                         if self.__current_tool_active:
                             self.__current_tool_active = False
-                            self.__past_drawing_points = []
+                            self.__stroke.add(event.pos)
+                            if self.__stroke:
+                                self.drawing(self.__stroke.take())
+                            self._canvas_event(("end",))
 
                     elif event.button == 3:
                         self.__options_menu_open = False
                         self.options_checker(mouse_pos)
 
-            if self.__current_tool == "Drawing" and self.__current_tool_active:
-                self.drawing(mouse_pos, self.__current_RGB)
+            if self.__current_tool_active and self.__stroke:
+                self.drawing(self.__stroke.take())
 
-            if self.__current_tool == "Rubber" and self.__current_tool_active:
-                self.drawing(mouse_pos, CANVAS_BACKGROUND)
+            for sender, canvas_event in self.server.canvas_events():
+                self.__dirty.add(self.__shared_canvas.apply(canvas_event, sender))
 
-            self.screen.blit(self.__canvas, (0, 0))
-            if self.__options_menu_open:
-                self.screen.blit(self.__options_menu, self.__settings_pos)
+            self._track_overlay_changes()
+            self.clock.tick(settings["MaxFps"])
+            self.present()
 
-            self._word_list_renderer()
-            self.skip_cur_word_renderer()
-            if self.server.word_pattern == 'loading...':
-                self.start_new_game_renderer()
-
-            for box in entryboxes:
-                box.render()
-            self.timer()
-            self.clock.tick(60)
+        print(
+            f" [ \033[34mRender\033[0m ] Skipped {self.frames_skipped} frames while idle"
+        )
+
+    def present(self):
+        # Puts everything that changed since the last frame on the display
+        if self.__full_redraw:
+            self.__dirty.flush()
+            self._composite()
             pygame.display.update()
+        else:
+            rects = self.__dirty.flush()
+            for rect in rects:
+                self._composite(rect)
+            pygame.display.update(rects)
+
+    def _track_overlay_changes(self):
+        # Everything drawn over the canvas reports where it changed since last frame
+        if self.__chat.update(self.server.chat_log):
+            self.__dirty.add(CHAT_AREA)
+
+        # the round is timed by the server, everyone counts down to the same moment
+        round_end = self.server.round_end
+        timer_text = (
+            "" if round_end is None else str(max(int(round_end - time.time()), 0))
+        )
+        if timer_text != self.__timer_text:
+            self.__dirty.add(self.__timer_rect)
+            self.__timer_text = timer_text
+            self.__timer_rect = self.text.render(timer_text, True, BLACK).get_rect(
+                topleft=(800, 500)
+            )
+            self.__dirty.add(self.__timer_rect)
+
+        menu_at = self.__settings_pos if self.__options_menu_open else None
+        if menu_at != self.__menu_drawn_at:
+            for position in (menu_at, self.__menu_drawn_at):
+                if position is not None:
+                    self.__dirty.add((*position, 400, 400))
+            self.__menu_drawn_at = menu_at
+
+        start_button_shown = self.server.word_pattern == "loading..."
+        if start_button_shown != self.__start_button_shown:
+            self.__dirty.add((1700, 850, 100, 50))
+            self.__start_button_shown = start_button_shown
+
+        for box in entryboxes:
+            if box.refresh():
+                self.__dirty.add(box.rect)
+                if box.has_button:
+                    self.__dirty.add(box.button_rect)
+
+    def _composite(self, area=None):
+        # Redraws the canvas and everything on top of it, limited to area if given
+        area = self.screen.get_rect() if area is None else area
+        self.screen.set_clip(area)
+
+        self.screen.blit(self.__canvas, area, area)
+        if self.__options_menu_open:
+            self.screen.blit(self.__options_menu, self.__settings_pos)
+
+        if area.colliderect(CHAT_AREA):
+            self._word_list_renderer()
+        self.skip_cur_word_renderer()
+        if self.__start_button_shown:
+            self.start_new_game_renderer()
+
+        for box in entryboxes:
+            box.render()
+        self.timer()
+
+        self.screen.set_clip(None)
+
+    def _canvas_changed(self, rect):
+        self.__dirty.add(rect)
+        self.__history.touch(rect)
+
+    def _canvas_event(self, event):
+        # Draws locally and sends the event on so everyone else can replay it
+        self.__dirty.add(self.__shared_canvas.apply(event))
+        self.server.send_canvas_event(event)
+
+    def undo(self):
+        self._canvas_event(("undo",))
+
+    def redo(self):
+        self._canvas_event(("redo",))
 
     def _reset_states(self, box=None):
         # Careful with what you put in the function, might end up screwing things up later down the line... (tommys predictions)
@@ -231,71 +366,26 @@ class Renderer:
 
     def _word_list_renderer(self):
         pygame.draw.rect(self.screen, (255, 0, 0), (1580, 20, 320, 740), width=1)
-        lines_taken = 0
-        max_lines = 27
-        max_length = 30
-        for i in self.server.chat_log[:-max_lines:-1]:
-            temp_lines_taken = 0
-            broken_message = split_by_max_length(i, max_length)
-            for x in broken_message[::-1]:
-                self.screen.blit(
-                self.font.render(
-                    x,
+
+        for lines_taken, line in enumerate(reversed(self.__chat.lines)):
+            self.screen.blit(
+                self.text.render(
+                    line,
                     True,
                     (111, 111, 111),
                 ),
                 (1600, 740 - lines_taken * 25),
-                )
-                lines_taken += 1
-
-    def drawing(self, position, RGB):
-        # [pos before last pos, last pos, current pos]
-        self.__past_drawing_points.append(position)
-
-        if len(self.__past_drawing_points) == 1:
-            pygame.draw.circle(
-                self.__canvas,
-                RGB,
-                self.__past_drawing_points[0],
-                self.__pen_size // 2,
-            )
-
-        elif len(self.__past_drawing_points) == 2:
-            pygame.draw.line(
-                self.__canvas,
-                RGB,
-                self.__past_drawing_points[0],
-                self.__past_drawing_points[1],
-                self.__pen_size,
-            )
-            pygame.draw.circle(
-                self.__canvas,
-                RGB,
-                self.__past_drawing_points[0],
-                self.__pen_size // 2,
-            )
-            pygame.draw.circle(
-                self.__canvas,
-                RGB,
-                self.__past_drawing_points[1],
-                self.__pen_size // 2,
             )
 
-        else:
-            try:
-                draw_line_interpolated_1(
-                    self.__past_drawing_points, self.__canvas, RGB, self.__pen_size
-                )
-            except ZeroDivisionError:
-                ...
+    def begin_stroke(self, RGB):
+        self._canvas_event(("begin", self.__current_tool, RGB, max(self.__pen_size, 1)))
 
-            self.__past_drawing_points.pop(0)
+    def drawing(self, points):
+        # all points collected this frame, drawn in one go
+        self._canvas_event(("points", points))
 
     def timer(self):
-        self.screen.blit(
-            self.font.render(str(int(self.__round_end - time.time())), True, BLACK),
-            (800, 500),
-        )
+        self.screen.blit(self.text.render(self.__timer_text, True, BLACK), (800, 500))
 
     def options_menu(self):
         # self.__options_menu = pygame.Surface((400, 400), pygame.SRCALPHA)
@@ -379,12 +469,9 @@ class Renderer:
                 self.clear_screen()
 
             elif angle < math.pi / 2:
-                threading.Thread(
-                    target=lambda: self.filler(
-                        (self.__settings_pos[0] + 200, self.__settings_pos[1] + 200)
-                    ),
-                    daemon=True,
-                ).start()
+                self.filler(
+                    (self.__settings_pos[0] + 200, self.__settings_pos[1] + 200)
+                )
 
             elif angle < math.pi * 3 / 4:
                 self.set_rubber()
@@ -429,37 +516,15 @@ class Renderer:
         self.__current_tool = "Filler"
 
     def filler(self, mouse_pos):
-        stack = [mouse_pos]
-
-        while stack:
-            item = stack.pop()
-
-            for offset in [(1, 0), (0, 1), (-1, 0), (0, -1)]:
-                question = (item[0] + offset[0], item[1] + offset[1])
-
-                if (
-                    question[0] < 0
-                    or question[0] > 1919
-                    or question[1] < 0
-                    or question[1] > 1079
-                ):
-                    continue
-
-                if question in stack:
-                    continue
-
-                if self.__canvas.get_at(question) != CANVAS_BACKGROUND:
-                    continue
-
-                stack.insert(0, question)
-
-            self.__canvas.set_at(item, self.__current_RGB)
+        self._canvas_event(
+            ("fill", mouse_pos, self.__current_RGB, settings["FillTolerance"])
+        )
 
     def color_setter(self):
         ...
 
     def clear_screen(self):
-        self.__canvas.fill(CANVAS_BACKGROUND)
+        self._canvas_event(("clear", CANVAS_BACKGROUND))
 
 
 class TextEntryBox:
@@ -480,6 +545,7 @@ class TextEntryBox:
         self.__on_enter = on_enter
         self.__blur = blur
         self.__pointer = -1
+        self.__drawn_state = None
         # Public
         entryboxes.append(self)
         self.writing = False
@@ -544,14 +610,21 @@ class TextEntryBox:
             )
         self.__display_string = self.__current_string
 
-    def render(self):
-        # Drawing surfaces and blinking cursor
+    def refresh(self):
+        # Redraws the box surface and blinking cursor, only if anything visible changed
         if self.__blur and self.__display_string != self.__default:
             self.__display_string = "".join("*" * len(self.__current_string))
-        rendered_text = self.__font.render(self.__display_string, True, BLACK)
+
+        cursor_shown = (time.time() % 1 > 0.5) and self.writing
+        state = (self.__display_string, self.__pointer, self.col, cursor_shown)
+        if state == self.__drawn_state:
+            return False
+        self.__drawn_state = state
+
+        rendered_text = self.renderer.text.render(self.__display_string, True, BLACK)
         text_rect = rendered_text.get_rect()
 
-        if (time.time() % 1 > 0.5) and self.writing:
+        if cursor_shown:
             self.__cursor_surf.fill(BLACK)
         else:
             self.__cursor_surf.fill(self.col)
@@ -577,6 +650,9 @@ class TextEntryBox:
                 text_rect.bottom - self.renderer.font.get_height() + 5,
             ),
         )
+        return True
+
+    def render(self):
         if self.has_button:
             self.renderer.screen.blit(self.__button_surface, self.button_rect)
         self.renderer.screen.blit(self.__box_surface, self.rect)
@@ -590,7 +666,7 @@ if __name__ == "__main__":
     # Temporary
     url, port = settings["ServerAddress"], settings["Port"]
 
-    server = Client((url, port), settings["Name"])
+    server = Client((url, port), settings["Name"], room=settings["Room"])
     server.start()
     server.wait_till_success()
 
@@ -0,0 +1,322 @@
+import selectors
+import socket
+import struct
+import time
+
+# The wire format shared by the client and the server, every packet is a 4 byte
+# opcode followed by the fields listed for it in PACKETS, all big endian
+
+STRING = "string"  # 2 byte length + utf-8
+INT = "int"  # 4 byte unsigned
+STRINGS = "strings"  # 4 byte count + that many strings
+POINTS = "points"  # 4 byte count + that many pairs of signed 2 byte x, y
+BLOB = "blob"  # 4 byte length + raw bytes
+TIME = "time"  # 8 byte float, seconds since the epoch on the sender's clock
+
+PACKETS = {
+    # either side may ping, the reply echoes the ping's time and adds the replier's,
+    # which is enough to work out the round trip time and the offset between clocks
+    b"PING": (TIME,),
+    b"PONG": (TIME, TIME),
+    # player name, room to join or open, blank for the default room
+    b"JOIN": (STRING, STRING),
+    # the room lives on another server process, reconnect to this port and JOIN again
+    b"MOVE": (INT,),
+    b"WORD": (STRING,),
+    b"CHAT": (STRING,),
+    b"STRT": (),
+    b"SKIP": (),
+    # remove the current word from the word list, add one to the end of it
+    b"WDEL": (),
+    b"WADD": (STRING,),
+    b"LOBY": (STRINGS,),
+    b"FRME": (BLOB,),
+    # canvas events, all starting with who drew them: players send 0 and the server
+    # fills in their id as it passes them on
+    # stroke begin (tool, rgb, pen size), points, end
+    b"STBG": (INT, STRING, INT, INT),
+    b"STPT": (INT, POINTS),
+    b"STEN": (INT,),
+    # x, y, rgb, tolerance
+    b"FILL": (INT, INT, INT, INT, INT),
+    # rgb
+    b"CLER": (INT, INT),
+    b"UNDO": (INT,),
+    b"REDO": (INT,),
+    # the current round ends at this time on the server's clock
+    b"ROND": (TIME,),
+}
+
+_LENGTH = struct.Struct(">H")
+_COUNT = struct.Struct(">I")
+_POINT = struct.Struct(">hh")
+_TIME = struct.Struct(">d")
+
+
+class ProtocolError(Exception):
+    ...
+
+
+def _strings_to_bytes(kind, value):
+    if kind == STRING:
+        return value.encode()
+    elif kind == STRINGS:
+        return [string.encode() for string in value]
+    return value
+
+
+def _field_size(kind, value) -> int:
+    if kind == STRING:
+        return _LENGTH.size + len(value)
+    elif kind == INT:
+        return _COUNT.size
+    elif kind == STRINGS:
+        return _COUNT.size + sum(_LENGTH.size + len(string) for string in value)
+    elif kind == POINTS:
+        return _COUNT.size + _POINT.size * len(value)
+    elif kind == BLOB:
+        return _COUNT.size + len(value)
+    elif kind == TIME:
+        return _TIME.size
+
+    raise ProtocolError(f"Unknown field type {kind}")
+
+
+def encode(opcode: bytes, *fields) -> bytes:
+    """
+    Packs a whole packet into one buffer, ready for a single sendall
+    """
+    kinds = PACKETS.get(opcode)
+    if kinds is None or len(kinds) != len(fields):
+        raise ProtocolError(f"Bad packet {opcode!r} with {len(fields)} fields")
+
+    # strings are sized and packed as bytes
+    fields = [_strings_to_bytes(kind, value) for kind, value in zip(kinds, fields)]
+
+    buffer = bytearray(
+        len(opcode)
+        + sum(_field_size(kind, value) for kind, value in zip(kinds, fields))
+    )
+    buffer[: len(opcode)] = opcode
+    offset = len(opcode)
+
+    for kind, value in zip(kinds, fields):
+        if kind == STRING:
+            _LENGTH.pack_into(buffer, offset, len(value))
+            offset += _LENGTH.size
+            buffer[offset : offset + len(value)] = value
+            offset += len(value)
+
+        elif kind == INT:
+            _COUNT.pack_into(buffer, offset, value)
+            offset += _COUNT.size
+
+        elif kind == STRINGS:
+            _COUNT.pack_into(buffer, offset, len(value))
+            offset += _COUNT.size
+            for string in value:
+                _LENGTH.pack_into(buffer, offset, len(string))
+                offset += _LENGTH.size
+                buffer[offset : offset + len(string)] = string
+                offset += len(string)
+
+        elif kind == POINTS:
+            _COUNT.pack_into(buffer, offset, len(value))
+            offset += _COUNT.size
+            struct.pack_into(
+                f">{len(value) * 2}h",
+                buffer,
+                offset,
+                *(coordinate for point in value for coordinate in point),
+            )
+            offset += _POINT.size * len(value)
+
+        elif kind == BLOB:
+            _COUNT.pack_into(buffer, offset, len(value))
+            offset += _COUNT.size
+            buffer[offset : offset + len(value)] = value
+            offset += len(value)
+
+        elif kind == TIME:
+            _TIME.pack_into(buffer, offset, value)
+            offset += _TIME.size
+
+    return bytes(buffer)
+
+
+def decode(data: bytes) -> tuple[bytes, list]:
+    """
+    Unpacks one whole packet, the opposite of encode
+    :raises ProtocolError: if data is not exactly one packet
+    """
+    parser = PacketParser()
+    parser.feed(data)
+    packet = parser.next_packet()
+
+    if packet is None or len(parser):
+        raise ProtocolError("Not exactly one packet")
+    return packet
+
+
+class PacketParser:
+    """
+    Turns a stream of bytes into packets, data can arrive in pieces of any size,
+    a packet is only handed out once every byte of it has arrived
+    """
+
+    def __init__(self, max_packet_size: int = 16 * 1024 * 1024):
+        self._buffer = bytearray()
+        self._max_packet_size = max_packet_size
+        # bytes the packet last handed out took up on the wire
+        self.last_size = 0
+
+    def feed(self, data: bytes):
+        self._buffer += data
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def next_packet(self) -> tuple[bytes, list] | None:
+        """
+        :return: (opcode, fields) of the next complete packet, None if it has not all arrived
+        :raises ProtocolError: on an unknown opcode, the stream can not be recovered after
+        """
+        try:
+            packet = self._parse()
+        except UnicodeDecodeError as error:
+            raise ProtocolError(f"Bad string in packet: {error}") from None
+
+        if packet is None:
+            return None
+
+        opcode, fields, size = packet
+        del self._buffer[:size]
+        self.last_size = size
+        return opcode, fields
+
+    def _parse(self):
+        buffer = self._buffer
+        if len(buffer) < 4:
+            return None
+
+        opcode = bytes(buffer[:4])
+        kinds = PACKETS.get(opcode)
+        if kinds is None:
+            raise ProtocolError(f"Unknown packet {opcode!r}")
+
+        offset = 4
+        fields = []
+
+        for kind in kinds:
+            if kind == STRING:
+                if len(buffer) < offset + _LENGTH.size:
+                    return None
+                (length,) = _LENGTH.unpack_from(buffer, offset)
+                offset += _LENGTH.size
+                if len(buffer) < offset + length:
+                    return None
+                fields.append(buffer[offset : offset + length].decode())
+                offset += length
+                continue
+
+            if kind == TIME:
+                if len(buffer) < offset + _TIME.size:
+                    return None
+                fields.append(_TIME.unpack_from(buffer, offset)[0])
+                offset += _TIME.size
+                continue
+
+            if len(buffer) < offset + _COUNT.size:
+                return None
+            (count,) = _COUNT.unpack_from(buffer, offset)
+            offset += _COUNT.size
+
+            if kind == INT:
+                fields.append(count)
+
+            elif kind == STRINGS:
+                strings = []
+                for _ in range(count):
+                    if len(buffer) < offset + _LENGTH.size:
+                        return None
+                    (length,) = _LENGTH.unpack_from(buffer, offset)
+                    offset += _LENGTH.size
+                    if len(buffer) < offset + length:
+                        return None
+                    strings.append(buffer[offset : offset + length].decode())
+                    offset += length
+                fields.append(strings)
+
+            elif kind == POINTS:
+                size = _POINT.size * count
+                self._check_size(size)
+                if len(buffer) < offset + size:
+                    return None
+                coordinates = struct.unpack_from(f">{count * 2}h", buffer, offset)
+                fields.append(list(zip(coordinates[::2], coordinates[1::2])))
+                offset += size
+
+            elif kind == BLOB:
+                self._check_size(count)
+                if len(buffer) < offset + count:
+                    return None
+                fields.append(bytes(buffer[offset : offset + count]))
+                offset += count
+
+        return opcode, fields, offset
+
+    def _check_size(self, size):
+        if size > self._max_packet_size:
+            raise ProtocolError(f"Packet of {size} bytes is too large")
+
+
+class PacketReader:
+    """
+    Reads whole packets from a blocking socket
+
+    The socket itself is left blocking so sends from other threads are never cut short
+    by a timeout, waiting for data is done with a selector instead. Whatever part of a
+    packet arrived before a timeout stays buffered for the next read_packet.
+    """
+
+    def __init__(self, sock: socket.socket, chunk_size: int = 65536):
+        self._socket = sock
+        self._chunk_size = chunk_size
+        self._parser = PacketParser()
+        self.bytes_received = 0
+        # select() is limited to low descriptor numbers, a busy server goes past that
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(sock, selectors.EVENT_READ)
+
+    @property
+    def last_size(self) -> int:
+        return self._parser.last_size
+
+    def close(self):
+        self._selector.close()
+
+    def read_packet(self, timeout: float | None = None) -> tuple[bytes, list] | None:
+        """
+        :param timeout: seconds to wait for a whole packet, None waits forever
+        :return: (opcode, fields), None if the timeout ran out first
+        :raises ConnectionError: if the other side closed the connection
+        :raises ProtocolError: if the other side sent something that is not a packet
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            packet = self._parser.next_packet()
+            if packet is not None:
+                return packet
+
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+                if not self._selector.select(remaining):
+                    return None
+
+            data = self._socket.recv(self._chunk_size)
+            if not data:
+                raise ConnectionResetError("Connection closed by the other side")
+
+            self.bytes_received += len(data)
+            self._parser.feed(data)
@@ -0,0 +1,325 @@
+import functools
+
+import numpy
+import pygame
+
+
+def _mask_runs(mask: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Finds every horizontal run of True in a (height, width) mask
+    :return: (run starts, exclusive run ends) as indices into the mask flattened with
+    one extra column per row, sorted by row then x
+    """
+    height, width = mask.shape
+    # a False column on both sides ends every run before the next row starts
+    padded = numpy.zeros((height, width + 2), dtype=bool)
+    padded[:, 1:-1] = mask
+    changes = numpy.flatnonzero(padded[:, 1:] != padded[:, :-1])
+    return changes[::2], changes[1::2]
+
+
+def _matching_mask(
+    surface: pygame.Surface, position: tuple[int, int], tolerance: int
+) -> numpy.ndarray:
+    """
+    Builds a (height, width) mask of every pixel close enough to the colour at position
+    :param tolerance: maximum per channel difference still counted as the same colour
+    """
+    if tolerance <= 0:
+        pixels = pygame.surfarray.pixels2d(surface)
+        mask = pixels == pixels[position]
+
+    else:
+        pixels = pygame.surfarray.pixels3d(surface)
+        mask = numpy.ones(pixels.shape[:2], dtype=bool)
+
+        # per channel range checks keep everything in uint8, much faster than abs()
+        for channel, target in enumerate(pixels[position].tolist()):
+            values = pixels[..., channel]
+            mask &= values >= max(target - tolerance, 0)
+            mask &= values <= min(target + tolerance, 255)
+
+    del pixels
+    # surfarray is indexed [x, y], rows are much nicer to scan
+    return numpy.ascontiguousarray(mask.T)
+
+
+def flood_fill(
+    surface: pygame.Surface,
+    position: tuple[int, int],
+    rgb: tuple[int, int, int],
+    tolerance: int = 0,
+) -> pygame.Rect | None:
+    """
+    Flood fill, replaces the region connected to position with rgb
+    :param surface: surface to fill, modified in place
+    :param position: seed pixel, the colour under it is the one being replaced
+    :param rgb: colour to fill with
+    :param tolerance: maximum per channel difference from the seed colour to still fill
+    :return: bounding rect of the filled pixels, None if nothing was filled
+    """
+    width, height = surface.get_size()
+    x, y = int(position[0]), int(position[1])
+
+    if not (0 <= x < width and 0 <= y < height):
+        return None
+
+    if tolerance <= 0 and surface.get_at((x, y))[:3] == tuple(rgb)[:3]:
+        return None
+
+    mask = _matching_mask(surface, (x, y), tolerance)
+    starts, ends = _mask_runs(mask)
+    stride = width + 1
+
+    # runs in the next row overlapping each run, found for all runs at once
+    below_first = numpy.searchsorted(ends, starts + stride, side="right")
+    below_last = numpy.searchsorted(starts, ends + stride, side="left")
+    overlaps = numpy.maximum(below_last - below_first, 0)
+    upper = numpy.repeat(numpy.arange(len(starts)), overlaps)
+    lower = numpy.arange(len(upper)) - numpy.repeat(
+        numpy.cumsum(overlaps) - overlaps - below_first, overlaps
+    )
+
+    # connected runs via hooking and pointer jumping, a handful of passes over all
+    # runs instead of one python iteration per span
+    parent = numpy.arange(len(starts))
+
+    while True:
+        upper_root, lower_root = parent[upper], parent[lower]
+        merging = upper_root != lower_root
+
+        if not merging.any():
+            break
+
+        low = numpy.minimum(upper_root[merging], lower_root[merging])
+        high = numpy.maximum(upper_root[merging], lower_root[merging])
+        parent[high] = low
+
+        while True:
+            jumped = parent[parent]
+
+            if numpy.array_equal(jumped, parent):
+                break
+
+            parent = jumped
+
+    seed = int(numpy.searchsorted(starts, y * stride + x, side="right")) - 1
+    region = parent == parent[seed]
+    region_starts, region_ends = starts[region], ends[region]
+
+    rows = region_starts // stride
+    left_most = int((region_starts % stride).min())
+    right_most = int((region_ends - rows * stride).max())
+    top_most, bottom_most = int(rows[0]), int(rows[-1])
+
+    # only the rows the region spans are turned back into pixels
+    first = top_most * stride
+    edges = numpy.zeros((bottom_most + 1) * stride - first + 1, dtype=numpy.int8)
+    edges[region_starts - first] = 1
+    edges[region_ends - first] = -1
+    filled = numpy.cumsum(edges[:-1], dtype=numpy.int8).view(bool)
+
+    pixels = pygame.surfarray.pixels2d(surface)
+    region_pixels = pixels[:, top_most : bottom_most + 1]
+    region_pixels[filled.reshape(-1, stride)[:, :width].T] = surface.map_rgb(rgb)
+    del pixels, region_pixels
+
+    return pygame.Rect(
+        left_most, top_most, right_most - left_most, bottom_most - top_most + 1
+    )
+
+
+INTERPOLATE_STEP = 20
+
+
+@functools.lru_cache(maxsize=32)
+def _disc_spans(radius: int) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    The pixels pygame.draw.circle fills, which the original renderer put on every point
+    of a stroke, as one span per row
+    :return: (row offsets, span start offsets, span end offsets) from the centre
+    """
+    if radius < 1:
+        empty = numpy.zeros(0, dtype=int)
+        return empty, empty, empty
+
+    # drawn once with pygame itself, the circle is a little off centre
+    size = 2 * radius + 2
+    stamp = pygame.Surface((size, size))
+    pygame.draw.circle(stamp, (255, 255, 255), (radius, radius), radius)
+    mask = pygame.surfarray.array2d(stamp).T != 0
+
+    rows = numpy.flatnonzero(mask.any(axis=1))
+    starts = mask[rows].argmax(axis=1)
+    ends = size - mask[rows, ::-1].argmax(axis=1)
+    return rows - radius, starts - radius, ends - radius
+
+
+def _smoothed_segments(points: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Evaluates the stroke smoothing curve for every point of a stroke at once
+    the curve between two points bends along the direction the pen was already heading in
+    :param points: (n, 2) stroke points, the curves are built for points[2:]
+    :return: (start, end) arrays of the line segments making up the curves
+    """
+    first, before, current = points[:-2], points[1:-1], points[2:]
+
+    true = numpy.hypot(*(current - before).T)
+    projected = numpy.hypot(*(before - first).T)
+    final = numpy.minimum(projected, true * 0.3)
+
+    # a pen that did not move has no direction, fall back to a straight line
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        scale = numpy.where(projected > 0, final / projected, 0.0)
+
+    # truncating at every step like the original per point renderer keeps strokes identical
+    projection = numpy.trunc(before - scale[:, None] * (first - before))[:, None]
+    before, current = before[:, None], current[:, None]
+
+    t = (numpy.arange(INTERPOLATE_STEP) / INTERPOLATE_STEP)[None, :, None]
+    towards_before = numpy.trunc(t * before + (1 - t) * projection)
+    towards_projection = numpy.trunc(t * projection + (1 - t) * current)
+    curve = numpy.trunc(t * towards_before + (1 - t) * towards_projection)
+
+    starts = curve
+    ends = numpy.concatenate((curve[:, 1:], before), axis=1)
+    return starts.reshape(-1, 2), ends.reshape(-1, 2)
+
+
+def _line_spans(
+    starts: numpy.ndarray, ends: numpy.ndarray, width: int, size: tuple[int, int]
+) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    The pixels pygame.draw.line fills for every segment, as spans
+    pygame thickens a line straight across its minor axis rather than at right angles
+    to it, so diagonal lines come out thinner than width
+    :param size: of the surface, pixels too far off it to touch it are left out
+    :return: (rows, span starts, span ends)
+    """
+    deltas = ends - starts
+    lengths = numpy.abs(deltas).max(axis=1)
+    counts = lengths + 1
+
+    # one pixel per step along the major axis
+    segment = numpy.repeat(numpy.arange(len(starts)), counts)
+    step = numpy.arange(counts.sum()) - numpy.repeat(
+        numpy.cumsum(counts) - counts, counts
+    )
+    t = (step / numpy.maximum(lengths[segment], 1))[:, None]
+    pixels = numpy.rint(starts[segment] + deltas[segment] * t).astype(int)
+
+    near = (pixels >= -width).all(axis=1) & (pixels < numpy.add(size, width)).all(
+        axis=1
+    )
+    pixels, segment = pixels[near], segment[near]
+
+    # steep and diagonal lines are thickened sideways, the rest up and down
+    sideways = numpy.abs(deltas[segment, 0]) <= numpy.abs(deltas[segment, 1])
+    thickness = numpy.arange(-(width // 2) + 1 - width % 2, width // 2 + 1)
+
+    across = pixels[sideways]
+    down = pixels[~sideways]
+    rows = numpy.concatenate(
+        (across[:, 1], (down[:, 1, None] + thickness[None, :]).ravel())
+    )
+    span_starts = numpy.concatenate(
+        (across[:, 0] + thickness[0], numpy.repeat(down[:, 0], len(thickness)))
+    )
+    span_ends = numpy.concatenate(
+        (across[:, 0] + thickness[-1] + 1, numpy.repeat(down[:, 0] + 1, len(thickness)))
+    )
+    return rows, span_starts, span_ends
+
+
+def rasterize_stroke(
+    surface: pygame.Surface,
+    points: list[tuple[int, int]],
+    rgb: tuple[int, int, int],
+    line_width: int,
+    history: list[tuple[int, int]] = (),
+) -> pygame.Rect | None:
+    """
+    Draws a batch of stroke points onto a surface with a single masked write
+    :param surface: surface to draw on, modified in place
+    :param points: new points of the stroke, usually everything collected this frame
+    :param rgb: colour of the pen
+    :param line_width: width of the pen in pixels
+    :param history: up to the last two points already drawn for this stroke,
+                    needed to continue the smoothing across batches
+    :return: bounding rect of the area drawn to, None if nothing was drawn
+    """
+    if not points:
+        return None
+
+    history = list(history)[-2:]
+    stroke = numpy.array(history + list(points), dtype=float)
+
+    # like the original renderer the first point of a stroke is a dot, the second a
+    # straight line to it and every point after that curves towards the one before
+    none = numpy.zeros((0, 2))
+    starts, ends, vertices = [none], [none], [none]
+
+    if not history:
+        vertices.append(stroke[:1])
+
+    if len(history) < 2 and len(stroke) >= 2:
+        starts.append(stroke[:1])
+        ends.append(stroke[1:2])
+        vertices.append(stroke[:2])
+
+    if len(stroke) >= 3:
+        curve_starts, curve_ends = _smoothed_segments(stroke)
+        # every curve starts with a line from its point to itself
+        starts += [stroke[2:], curve_starts]
+        ends += [stroke[2:], curve_ends]
+        vertices.append(curve_starts)
+
+    starts = numpy.concatenate(starts).astype(int)
+    ends = numpy.concatenate(ends).astype(int)
+    vertices = numpy.concatenate(vertices).astype(int)
+
+    # a circle on every point the pen went through and a line between each of them
+    disc_rows, disc_starts, disc_ends = _disc_spans(line_width // 2)
+    line_rows, line_starts, line_ends = _line_spans(
+        starts, ends, line_width, surface.get_size()
+    )
+
+    span_rows = numpy.concatenate(
+        ((vertices[:, 1, None] + disc_rows[None, :]).ravel(), line_rows)
+    )
+    span_starts = numpy.concatenate(
+        ((vertices[:, 0, None] + disc_starts[None, :]).ravel(), line_starts)
+    )
+    span_ends = numpy.concatenate(
+        ((vertices[:, 0, None] + disc_ends[None, :]).ravel(), line_ends)
+    )
+    if not len(span_rows):
+        return None
+
+    width, height = surface.get_size()
+    left, top = max(int(span_starts.min()), 0), max(int(span_rows.min()), 0)
+    right = min(int(span_ends.max()), width)
+    bottom = min(int(span_rows.max()) + 1, height)
+
+    if left >= right or top >= bottom:
+        return None
+
+    # marking where each span starts and stops then running a cumulative sum along the
+    # rows fills them all in one go
+    span_starts = numpy.clip(span_starts, left, right)
+    span_ends = numpy.clip(span_ends, left, right)
+
+    visible = (span_rows >= top) & (span_rows < bottom) & (span_starts < span_ends)
+    row_offsets = (span_rows[visible] - top) * (right - left + 1) - left
+
+    size = (bottom - top) * (right - left + 1)
+    edges = numpy.bincount(row_offsets + span_starts[visible], minlength=size)
+    edges -= numpy.bincount(row_offsets + span_ends[visible], minlength=size)
+
+    mask = edges.reshape(bottom - top, right - left + 1).cumsum(axis=1)[:, :-1] > 0
+
+    pixels = pygame.surfarray.pixels2d(surface)
+    pixels[left:right, top:bottom][mask.T] = surface.map_rgb(rgb)
+    del pixels
+
+    return pygame.Rect(left, top, right - left, bottom - top)
@@ -0,0 +1,138 @@
+import re
+
+EXACT = "exact"
+CLOSE = "close"
+MISS = "miss"
+
+_WHITESPACE = re.compile(r"[\s_]+")
+
+
+def normalize(text: str) -> str:
+    """
+    Case, underscores and runs of whitespace do not matter when guessing
+    """
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Levenshtein distance where swapping two neighbouring letters also counts as one edit
+    :return: the distance, or limit + 1 as soon as it is certain to be over limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+
+        for j, char_b in enumerate(b, 1):
+            cost = char_a != char_b
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+
+            if (
+                previous_previous is not None
+                and j > 1
+                and char_a == b[j - 2]
+                and a[i - 2] == char_b
+            ):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+
+        if min(current) > limit:
+            return limit + 1
+
+        previous_previous, previous = previous, current
+
+    return min(previous[-1], limit + 1)
+
+
+def _deletions(word: str, depth: int) -> set[str]:
+    # every string left after removing up to depth characters from word
+    variants = frontier = {word}
+    for _ in range(depth):
+        frontier = {
+            variant[:i] + variant[i + 1 :]
+            for variant in frontier
+            for i in range(len(variant))
+        }
+        variants = variants | frontier
+    return variants
+
+
+class GuessMatcher:
+    """
+    Finds the words a guess is close to, using a table of every word with up to
+    max_distance letters deleted. Two strings within max_distance edits of each other
+    always share an entry, so a guess only needs its own deletions looked up and the
+    few candidates that turns up checked properly, never the whole list.
+
+    Checking a guess against the one word being drawn does not need the table, the
+    server only does that and builds it without words. The table is a snapshot, build
+    a new matcher when the list changes.
+    """
+
+    def __init__(self, words=(), max_distance: int = 2):
+        """
+        :param words: the word list, built into the index once, only lookup() needs it
+        :param max_distance: most edits a guess may be off by and still be close
+        """
+        self.max_distance = max_distance
+        self._words: list[str] = []
+        self._index: dict[str, list[int]] = {}
+
+        for word in dict.fromkeys(normalize(word) for word in words):
+            if not word:
+                continue
+
+            word_id = len(self._words)
+            self._words.append(word)
+
+            for variant in _deletions(word, max_distance):
+                self._index.setdefault(variant, []).append(word_id)
+
+    def __len__(self):
+        return len(self._words)
+
+    def allowed_distance(self, word: str) -> int:
+        # a letter off in a three letter word is close, two letters off is another word
+        return min(self.max_distance, len(word) // 3)
+
+    def lookup(self, guess: str) -> dict[str, int]:
+        """
+        :return: every listed word within max_distance edits of guess, with its distance
+        """
+        guess = normalize(guess)
+        candidates = set()
+
+        for variant in _deletions(guess, self.max_distance):
+            candidates.update(self._index.get(variant, ()))
+
+        matches = {}
+        for word_id in candidates:
+            word = self._words[word_id]
+            distance = edit_distance(guess, word, self.max_distance)
+            if distance <= self.max_distance:
+                matches[word] = distance
+
+        return matches
+
+    def check(self, guess: str, word: str) -> str:
+        """
+        :return: EXACT, CLOSE or MISS
+        """
+        guess, word = normalize(guess), normalize(word)
+        if guess == word:
+            return EXACT
+
+        limit = self.allowed_distance(word)
+        if limit == 0:
+            return MISS
+
+        # against a single word one bounded comparison beats going through the table
+        if edit_distance(guess, word, limit) <= limit:
+            return CLOSE
+        return MISS
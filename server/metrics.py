@@ -0,0 +1,138 @@
+import bisect
+import threading
+import time
+from collections import Counter
+
+# Upper bounds of the histogram buckets in seconds, doubling from 1us to about 17s
+BUCKETS = tuple(1e-6 * 2**i for i in range(25))
+
+
+class Histogram:
+    """
+    Counts durations into fixed buckets, cheap to add to and small however many
+    are added. Percentiles come out as the upper bound of their bucket.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        wanted = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= wanted:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(0.5) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+class Metrics:
+    """
+    Everything the server counts about itself, read with snapshot()
+
+    Called from every connection's thread in the threaded server, so changes are made
+    under one lock. It is only held for a few additions at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+        self.packets_in: Counter[bytes] = Counter()
+        self.bytes_in: Counter[bytes] = Counter()
+        self.packets_out: Counter[bytes] = Counter()
+        self.bytes_out: Counter[bytes] = Counter()
+        self.handlers: dict[bytes, Histogram] = {}
+        self.broadcasts = Histogram()
+        self.broadcast_recipients = 0
+        self.round_trips = Histogram()
+
+        self._gauges = {}
+
+    def gauge(self, name: str, read):
+        """
+        :param read: called for the current value whenever a snapshot is taken
+        """
+        self._gauges[name] = read
+
+    def handled(self, opcode: bytes, size: int, seconds: float):
+        """
+        A packet of size bytes came in and process_packet took seconds with it
+        """
+        with self._lock:
+            self.packets_in[opcode] += 1
+            self.bytes_in[opcode] += size
+
+            histogram = self.handlers.get(opcode)
+            if histogram is None:
+                histogram = self.handlers[opcode] = Histogram()
+            histogram.observe(seconds)
+
+    def sent(self, data: bytes, recipients: int = 1):
+        """
+        An encoded packet was queued for recipients clients
+        """
+        opcode = data[:4]
+        with self._lock:
+            self.packets_out[opcode] += recipients
+            self.bytes_out[opcode] += len(data) * recipients
+
+    def broadcasted(self, data: bytes, recipients: int, seconds: float):
+        self.sent(data, recipients)
+        with self._lock:
+            self.broadcasts.observe(seconds)
+            self.broadcast_recipients += recipients
+
+    def round_trip(self, seconds: float):
+        with self._lock:
+            self.round_trips.observe(seconds)
+
+    def snapshot(self) -> dict:
+        """
+        :return: every metric as plain JSON friendly values
+        """
+        with self._lock:
+            snapshot = {
+                "uptime": round(time.monotonic() - self._started, 1),
+                "in": _by_opcode(self.packets_in, self.bytes_in),
+                "out": _by_opcode(self.packets_out, self.bytes_out),
+                "handlers": {
+                    opcode.decode("ascii", "replace"): histogram.snapshot()
+                    for opcode, histogram in self.handlers.items()
+                },
+                "broadcasts": dict(
+                    self.broadcasts.snapshot(), recipients=self.broadcast_recipients
+                ),
+                "round_trips": self.round_trips.snapshot(),
+            }
+
+        for name, read in self._gauges.items():
+            snapshot[name] = read()
+
+        return snapshot
+
+
+def _by_opcode(packets, sizes):
+    return {
+        opcode.decode("ascii", "replace"): {"packets": count, "bytes": sizes[opcode]}
+        for opcode, count in packets.items()
+    }
@@ -0,0 +1,115 @@
+import threading
+from collections import deque
+
+# What to do when a client's outbox is full
+DROP = "drop"  # throw the new packet away
+COALESCE = "coalesce"  # replace a queued packet with the same key, else drop
+DISCONNECT = "disconnect"  # the client can not keep up, kick them
+POLICIES = (DROP, COALESCE, DISCONNECT)
+
+
+class Overflow(Exception):
+    ...
+
+
+class Outbox:
+    """
+    Bounded queue of encoded packets waiting to be written to one client
+
+    Anyone may put packets in, a single writer takes them out and sends everything
+    queued in one go. Packets are shared bytes objects, a broadcast encodes once and
+    every client queues the same buffer.
+    """
+
+    def __init__(
+        self, max_bytes: int = 4 * 1024 * 1024, policy: str = DISCONNECT, on_put=None
+    ):
+        """
+        :param max_bytes: queued bytes past which the overflow policy kicks in
+        :param policy: one of POLICIES
+        :param on_put: called after a packet was queued, wakes up an event loop writer
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy {policy!r}")
+
+        self._max_bytes = max_bytes
+        self._policy = policy
+        self._on_put = on_put
+
+        self._packets: deque[tuple[bytes | None, bytes]] = deque()
+        self._bytes = 0
+        self._condition = threading.Condition()
+        self.closed = False
+
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._packets)
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._bytes
+
+    def put(self, data: bytes, key: bytes | None = None):
+        """
+        :param key: packets with the same key make each other obsolete, e.g. lobby updates
+        :raises Overflow: if the outbox is full and the policy is to disconnect
+        """
+        with self._condition:
+            if self.closed:
+                return
+
+            if self._bytes + len(data) > self._max_bytes:
+                if self._policy == DISCONNECT:
+                    raise Overflow(f"{self._bytes} bytes waiting to be sent")
+
+                if self._policy == COALESCE and self._replace(key, data):
+                    self.coalesced += 1
+                else:
+                    self.dropped += 1
+                return
+
+            self._packets.append((key, data))
+            self._bytes += len(data)
+            self._condition.notify()
+
+        if self._on_put is not None:
+            self._on_put()
+
+    def take(self, timeout: float | None = None) -> list[bytes]:
+        """
+        Empties the outbox
+        :param timeout: seconds to wait for something to arrive if it is empty, None waits forever
+        :return: every queued packet in order, empty if the wait ran out or it was closed
+        """
+        with self._condition:
+            if not self._packets and not self.closed:
+                self._condition.wait(timeout)
+
+            packets = [data for _, data in self._packets]
+            self._packets.clear()
+            self._bytes = 0
+
+        return packets
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._packets.clear()
+            self._bytes = 0
+            self._condition.notify_all()
+
+    def _replace(self, key, data) -> bool:
+        # caller holds the lock, the newest queued packet with the same key is swapped out
+        if key is None:
+            return False
+
+        for index in range(len(self._packets) - 1, -1, -1):
+            queued_key, queued = self._packets[index]
+            if queued_key == key:
+                self._packets[index] = (key, data)
+                self._bytes += len(data) - len(queued)
+                return True
+
+        return False
@@ -0,0 +1,281 @@
+import bisect
+import collections
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+import protocol
+
+# What a record is
+IN = 0  # a packet a player in the room sent
+OUT = 1  # a packet sent to one player
+BROADCAST = 2  # a packet sent to everyone in the room
+KINDS = {IN: "in", OUT: "out", BROADCAST: "broadcast"}
+
+# the log starts with the magic, the time it was opened and the room's name
+MAGIC = b"PGREC\x01"
+HEADER = struct.Struct(">6sdH")
+# then records one after another: time, kind, player's port, packet length, packet
+RECORD = struct.Struct(">dBHI")
+# the index has an entry this often: the time and offset of the first record after it
+# and the offset of the last canvas clear before it, where catching up has to start
+INDEX_ENTRY = struct.Struct(">dQQ")
+INDEX_INTERVAL = 1.0
+# seconds records wait in memory before they are written out in one go
+FLUSH_INTERVAL = 0.5
+
+LOG_EXTENSION = ".pgr"
+INDEX_EXTENSION = ".pgi"
+
+log = logging.getLogger("server.recorder")
+
+
+class Recording:
+    """
+    Everything that went in and out of one room, from the moment it opened until it
+    closed, as an append-only log with an index of offsets next to it
+
+    record() is called for every packet, so all it does is put the packet on a queue.
+    The Recorder's thread encodes and writes what was queued every FLUSH_INTERVAL.
+    """
+
+    def __init__(self, path: str, room: str):
+        """
+        :param path: of the log without the extension, the index goes next to it
+        """
+        self.room = room
+        self.started = time.time()
+        self.closed = False
+        self.written = 0
+
+        self._queue = collections.deque()
+        self._log = open(path + LOG_EXTENSION, "xb", buffering=0)
+        self._index = open(path + INDEX_EXTENSION, "xb", buffering=0)
+
+        name = room.encode()
+        self._log.write(HEADER.pack(MAGIC, self.started, len(name)) + name)
+        self._offset = HEADER.size + len(name)
+        self._clear_offset = self._offset
+        self._next_index = self.started
+
+    def __len__(self):
+        return len(self._queue)
+
+    def record(self, kind: int, packet, peer: int = 0):
+        """
+        :param packet: the encoded packet, or (opcode, fields) to be encoded later on
+        :param peer: port of the player it came from or went to
+        """
+        if not self.closed:
+            self._queue.append((time.time(), kind, peer, packet))
+
+    def close(self):
+        # the recorder writes out what is left and closes the files
+        self.closed = True
+
+    def flush(self):
+        """
+        Writes out everything queued, from the Recorder's thread only
+        """
+        records = bytearray()
+        index = bytearray()
+
+        # deque pops are thread safe, records queued meanwhile go in the next flush
+        for _ in range(len(self._queue)):
+            when, kind, peer, packet = self._queue.popleft()
+            if not isinstance(packet, bytes):
+                packet = protocol.encode(packet[0], *packet[1])
+
+            offset = self._offset + len(records)
+            if kind == BROADCAST and packet[:4] == b"CLER":
+                self._clear_offset = offset
+
+            if when >= self._next_index:
+                index += INDEX_ENTRY.pack(when, offset, self._clear_offset)
+                self._next_index = when + INDEX_INTERVAL
+
+            records += RECORD.pack(when, kind, peer, len(packet))
+            records += packet
+
+        if records:
+            # the log first, the index never points past what is written
+            self._log.write(records)
+            self._index.write(index)
+            self._offset += len(records)
+            self.written += len(records)
+
+    def close_files(self):
+        self._log.close()
+        self._index.close()
+
+
+class Recorder:
+    """
+    Opens a Recording for every room and writes them all out from one thread, so the
+    threads and event loop serving players never wait on the disk
+    """
+
+    def __init__(self, directory: str, interval: float = FLUSH_INTERVAL):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._recordings: list[Recording] = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def open(self, room: str) -> Recording:
+        # named after the room and when it opened, a room opened again gets a new one
+        name = re.sub(r"[^\w-]", "_", room) or "_"
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"{name}-{stamp}")
+
+        number = 1
+        while os.path.exists(path + LOG_EXTENSION):
+            number += 1
+            path = os.path.join(self.directory, f"{name}-{stamp}-{number}")
+
+        recording = Recording(path, room)
+        with self._lock:
+            self._recordings.append(recording)
+        log.info("Recording room '%s' to %s%s", room, path, LOG_EXTENSION)
+        return recording
+
+    def stats(self) -> dict:
+        with self._lock:
+            recordings = list(self._recordings)
+        return {
+            "open": len(recordings),
+            "queued": sum(map(len, recordings)),
+            "written_bytes": sum(recording.written for recording in recordings),
+        }
+
+    def close(self):
+        """
+        Writes out everything still queued, for when the server stops
+        """
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self._flush()
+        self._flush(everything=True)
+
+    def _flush(self, everything=False):
+        with self._lock:
+            recordings = list(self._recordings)
+
+        for recording in recordings:
+            # closed is read before flushing, nothing can be queued after the last flush
+            closed = recording.closed or everything
+            try:
+                recording.flush()
+            except OSError:
+                log.exception("Recording of room '%s' failed", recording.room)
+                closed = recording.closed = True
+
+            if closed:
+                recording.close_files()
+                with self._lock:
+                    self._recordings.remove(recording)
+
+
+class RecordingReader:
+    """
+    A recording memory mapped for reading, a seek only looks at the index and the
+    records of at most one INDEX_INTERVAL
+
+    Works on recordings still being written too, it sees what was there when opened.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: of the log, with or without the extension
+        :raises ValueError: if it is not a recording
+        """
+        base = path[: -len(LOG_EXTENSION)] if path.endswith(LOG_EXTENSION) else path
+
+        with open(base + LOG_EXTENSION, "rb") as file:
+            self._log = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(base + INDEX_EXTENSION, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            # an empty file can not be mapped, nothing was recorded yet
+            self._index = (
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+            )
+
+        if len(self._log) < HEADER.size:
+            raise ValueError(f"{path} is not a recording")
+        magic, self.started, length = HEADER.unpack_from(self._log)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a recording")
+
+        self.room = self._log[HEADER.size : HEADER.size + length].decode()
+        self.first_offset = HEADER.size + length
+        self.entries = len(self._index) // INDEX_ENTRY.size
+
+    def close(self):
+        self._log.close()
+        if self.entries:
+            self._index.close()
+
+    def entry(self, number: int) -> tuple[float, int, int]:
+        """
+        :return: (time, offset, clear offset) of an index entry
+        """
+        return INDEX_ENTRY.unpack_from(self._index, number * INDEX_ENTRY.size)
+
+    @property
+    def ended(self) -> float:
+        # time of the last record, only the records after the last entry are read
+        ended = self.started
+        offset = self.entry(self.entries - 1)[1] if self.entries else self.first_offset
+        for when, *_ in self.records(offset):
+            ended = when
+        return ended
+
+    def seek(self, when: float) -> tuple[int, int]:
+        """
+        :param when: seconds since the epoch, like the record times
+        :return: offset of a record at or shortly before when and the offset of the
+            last canvas clear before that, replaying from the clear rebuilds the canvas
+        """
+        number = bisect.bisect_right(_IndexTimes(self), when) - 1
+        if number < 0:
+            return self.first_offset, self.first_offset
+
+        _, offset, clear_offset = self.entry(number)
+        return offset, clear_offset
+
+    def records(self, offset: int):
+        """
+        Yields (time, kind, peer, packet, offset of the next record) from offset on,
+        a record cut short at the end of the log is left out
+        """
+        data = self._log
+        while offset + RECORD.size <= len(data):
+            when, kind, peer, length = RECORD.unpack_from(data, offset)
+            start = offset + RECORD.size
+            if start + length > len(data):
+                return
+
+            offset = start + length
+            yield when, kind, peer, data[start:offset], offset
+
+
+class _IndexTimes:
+    # the index entries' times as a sequence, for bisect
+    def __init__(self, reader: RecordingReader):
+        self._reader = reader
+
+    def __len__(self):
+        return self._reader.entries
+
+    def __getitem__(self, number):
+        return self._reader.entry(number)[0]
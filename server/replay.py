@@ -0,0 +1,206 @@
+"""
+Plays a room's recording back to players and spectators as if it was live
+
+    python server/replay.py RECORDING [--at 0] [--speed 1] [--port 16324] [--http-port 8080]
+    python server/replay.py RECORDING --info
+
+A player joining gets the room as it was --at seconds in, everything drawn since the
+last clear straight away, then everything the room was sent as it happened, --speed
+times as fast. Spectators watch the canvas on the usual page.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+from recorder import BROADCAST, KINDS, RecordingReader
+from server import CANVAS_PACKETS, DEFAULT_HTTP_PORT, LOG_FORMAT, SERVER_PORT
+from spectators import SpectatorServer
+
+log = logging.getLogger("server.replay")
+
+
+async def play(reader: RecordingReader, at: float, speed: float, kinds, since_clear):
+    """
+    Yields (time, kind, peer, packet) of the records of the given kinds, those before
+    at straight away and the rest when they are due
+    :param at: seconds into the recording
+    :param since_clear: start from the last canvas clear before at rather than just
+        before at, for when the canvas has to be rebuilt
+    """
+    loop = asyncio.get_running_loop()
+    began = loop.time()
+    when = reader.started + at
+
+    offset, clear_offset = reader.seek(when)
+    for recorded, kind, peer, packet, _ in reader.records(
+        clear_offset if since_clear else offset
+    ):
+        if kind not in kinds:
+            continue
+
+        if recorded > when:
+            delay = (recorded - when) / speed - (loop.time() - began)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        yield max(recorded, when), kind, peer, packet
+
+
+class ReplayRoom:
+    """
+    What the SpectatorServer needs of a Room
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.spectators = None
+        self.canvas_events: list[bytes] = []
+
+    def add_canvas_event(self, event: bytes):
+        if event[:4] == b"CLER":
+            self.canvas_events.clear()
+        self.canvas_events.append(event)
+
+        if self.spectators is not None:
+            self.spectators.canvas_event(event)
+
+
+class Replay:
+    def __init__(self, reader: RecordingReader, at: float = 0.0, speed: float = 1.0):
+        self.reader = reader
+        self.at = at
+        self.speed = speed
+        self.players = 0
+        # looked up by the SpectatorServer like the server's own rooms
+        self.rooms = {reader.room: ReplayRoom(reader.room)}
+
+    def stats(self) -> dict:
+        return {
+            "room": self.reader.room,
+            "started": self.reader.started,
+            "at": self.at,
+            "speed": self.speed,
+            "players": self.players,
+        }
+
+    async def serve(self, port: int, http_port: int = 0):
+        listener = await asyncio.start_server(self._player, port=port)
+        log.info("Replaying room '%s' on port %s", self.reader.room, port)
+
+        if http_port:
+            spectators = SpectatorServer(self, http_port, self.reader.room)
+            asyncio.create_task(spectators.serve())
+            asyncio.create_task(self._play_canvas())
+
+        async with listener:
+            await listener.serve_forever()
+
+    async def _player(self, reader, writer):
+        parser = protocol.PacketParser()
+        stream = None
+        self.players += 1
+
+        try:
+            while data := await reader.read(65536):
+                parser.feed(data)
+
+                while (packet := parser.next_packet()) is not None:
+                    opcode, fields = packet
+                    if opcode == b"PING":
+                        writer.write(protocol.encode(b"PONG", fields[0], time.time()))
+                    elif opcode == b"JOIN" and stream is None:
+                        log.info("%s joined the replay", fields[0])
+                        stream = asyncio.create_task(self._stream(writer))
+                    # anything else they send has no say in a recording
+
+        except (ConnectionError, protocol.ProtocolError):
+            ...
+        finally:
+            self.players -= 1
+            if stream is not None:
+                stream.cancel()
+            writer.close()
+
+    async def _stream(self, writer):
+        # everything the room was sent, each player has their own playback
+        async for position, _, _, packet in play(
+            self.reader, self.at, self.speed, {BROADCAST}, since_clear=True
+        ):
+            if packet[:4] == b"ROND":
+                # round deadlines are moved to now, and shortened along with the speed
+                (end,) = protocol.decode(packet)[1]
+                packet = protocol.encode(
+                    b"ROND", time.time() + (end - position) / self.speed
+                )
+
+            writer.write(packet)
+            await writer.drain()
+
+        log.info("Replay finished")
+
+    async def _play_canvas(self):
+        # the room's canvas events, spectators see them drawn like on the live server
+        room = self.rooms[self.reader.room]
+
+        async for _, _, _, packet in play(
+            self.reader, self.at, self.speed, {BROADCAST}, since_clear=True
+        ):
+            if packet[:4] in CANVAS_PACKETS:
+                room.add_canvas_event(packet)
+
+
+def info(reader: RecordingReader):
+    ended = reader.ended
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(reader.started))
+    print(f"room      {reader.room}")
+    print(f"started   {started}")
+    print(f"length    {ended - reader.started:.1f} s")
+    print(f"index     {reader.entries} entries")
+
+    # a full scan, only done when asked for
+    counts = {}
+    for _, kind, _, packet, _ in reader.records(reader.first_offset):
+        key = KINDS[kind], packet[:4].decode("ascii", "replace")
+        counts[key] = counts.get(key, 0) + 1
+
+    for (kind, opcode), count in sorted(counts.items()):
+        print(f"{kind:9s} {opcode} {count:8d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("recording", help="a .pgr file written by server.py --record")
+    parser.add_argument(
+        "--at", type=float, default=0.0, help="seconds into the recording to start at"
+    )
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument(
+        "--http-port",
+        type=int,
+        default=DEFAULT_HTTP_PORT,
+        help="port of the spectator page, 0 turns it off",
+    )
+    parser.add_argument(
+        "--info", action="store_true", help="describe the recording and exit"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    reader = RecordingReader(args.recording)
+
+    if args.info:
+        return info(reader)
+
+    asyncio.run(Replay(reader, args.at, args.speed).serve(args.port, args.http_port))
+
+
+if __name__ == "__main__":
+    main()
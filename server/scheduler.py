@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+
+# 100ms ticks on 512 slots, a turn of the wheel is about 51 seconds
+TICK = 0.1
+SLOTS = 512
+
+log = logging.getLogger("server.scheduler")
+
+
+class Timer:
+    """
+    A callback waiting in the wheel, cancel() takes it out
+    """
+
+    __slots__ = ("when", "callback", "args", "rounds", "interval", "cancelled")
+
+    def __init__(self, when, callback, args, interval=None):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        # whole turns of the wheel left before it is due, for timers far ahead
+        self.rounds = 0
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel, every timer goes in the slot of the tick it is due on
+
+    Adding and cancelling are O(1), and a tick only looks at the timers in its own slot,
+    so it costs the same with ten thousand heartbeats as with ten. Timers fire on the
+    first tick at or after they are due, never early and at most a tick late.
+
+    Not thread safe and knows nothing about waiting, see Scheduler for that.
+    """
+
+    def __init__(self, tick: float = TICK, slots: int = SLOTS, now: float = 0.0):
+        self._tick = tick
+        self._slots: list[list[Timer]] = [[] for _ in range(slots)]
+        # slot of the next tick to run and the time it is due
+        self._current = 0
+        self._tick_time = now
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, timer: Timer):
+        ticks = max(math.ceil((timer.when - self._tick_time) / self._tick), 0)
+        timer.rounds, offset = divmod(ticks, len(self._slots))
+        self._slots[(self._current + offset) % len(self._slots)].append(timer)
+        self._count += 1
+
+    def next_due(self) -> float | None:
+        """
+        :return: when the next tick with something to do is due, None if nothing is left
+        """
+        if not self._count:
+            return None
+
+        for offset in range(len(self._slots)):
+            slot = self._slots[(self._current + offset) % len(self._slots)]
+            if any(timer.rounds == 0 for timer in slot):
+                return self._tick_time + offset * self._tick
+
+        # everything is more than a turn away
+        return self._tick_time + len(self._slots) * self._tick
+
+    def advance(self, now: float) -> list[Timer]:
+        """
+        Runs the wheel up to now
+        :return: the timers that are due, in the order they were due
+        """
+        if not self._count:
+            # nothing to go past, jump straight to now
+            self._tick_time = max(self._tick_time, now)
+            return []
+
+        due = []
+        while self._tick_time <= now:
+            slot = self._slots[self._current]
+            self._slots[self._current] = []
+            # moved on first, anything added while firing lands in a later tick
+            self._current = (self._current + 1) % len(self._slots)
+            self._tick_time += self._tick
+
+            for timer in slot:
+                if timer.cancelled:
+                    self._count -= 1
+                elif timer.rounds:
+                    timer.rounds -= 1
+                    self._slots[self._current - 1].append(timer)
+                else:
+                    self._count -= 1
+                    due.append(timer)
+
+            if not self._count:
+                self._tick_time = max(self._tick_time, now)
+                break
+
+        return due
+
+
+class Scheduler:
+    """
+    The server's one place for anything that happens at a time rather than when a
+    packet arrives: rounds ending, hints, heartbeats, evicting dead peers and lobby
+    refreshes. It sleeps until the next timer is due, an idle server does not wake up.
+
+    Driven either by serve() on the event loop, where callbacks run on the loop, or by
+    run() on a thread of its own for the threaded server.
+    """
+
+    def __init__(self, tick: float = TICK, slots: int = SLOTS):
+        self._lock = threading.Lock()
+        self._wheel = TimerWheel(tick, slots, time.monotonic())
+        self._sleep_until = None
+        self._wake = None
+
+    def __len__(self):
+        return len(self._wheel)
+
+    def call_later(self, delay: float, callback, *args) -> Timer:
+        return self._add(Timer(time.monotonic() + delay, callback, args))
+
+    def call_every(self, interval: float, callback, *args, first=None) -> Timer:
+        """
+        :param first: seconds until the first call, interval if not given
+        :return: one Timer for every call, cancelling it stops them all
+        """
+        delay = interval if first is None else first
+        return self._add(Timer(time.monotonic() + delay, callback, args, interval))
+
+    def _add(self, timer: Timer) -> Timer:
+        with self._lock:
+            self._wheel.add(timer)
+            wake = self._sleep_until is None or timer.when < self._sleep_until
+
+        if wake and self._wake is not None:
+            self._wake()
+        return timer
+
+    def _run_due(self) -> float | None:
+        # fires whatever is due, returns the time to sleep until
+        with self._lock:
+            due = self._wheel.advance(time.monotonic())
+
+        for timer in due:
+            if timer.cancelled:
+                continue
+
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                log.exception("Timer %s failed", timer.callback)
+
+            if timer.interval is not None and not timer.cancelled:
+                # kept on the same beat, unless it fell a whole interval behind
+                timer.when = max(timer.when + timer.interval, time.monotonic())
+                with self._lock:
+                    self._wheel.add(timer)
+
+        with self._lock:
+            self._sleep_until = self._wheel.next_due()
+            return self._sleep_until
+
+    def run(self):
+        """
+        Runs the timers on the calling thread, forever
+        """
+        event = threading.Event()
+        self._wake = event.set
+
+        while True:
+            # cleared first, a timer added while working out the sleep still wakes it
+            event.clear()
+            until = self._run_due()
+            event.wait(None if until is None else until - time.monotonic())
+
+    async def serve(self):
+        """
+        Runs the timers on the event loop, forever. Timers must then also be added from
+        the loop's thread.
+        """
+        event = asyncio.Event()
+        self._wake = event.set
+
+        while True:
+            event.clear()
+            until = self._run_due()
+            try:
+                timeout = None if until is None else until - time.monotonic()
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                ...
@@ -1,32 +1,208 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
 import random
+import signal
 import socket
+import sys
 import threading
 import time
+import zlib
+
+# modules shared with the client live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# pygame draws the spectators' canvas, it has nothing to say in the server's log
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import protocol
+from canvas_replay import CANVAS_BACKGROUND, NO_SENDER, checked_fields, pack_rgb
+from clock_sync import ClockSync
+from guess_matcher import CLOSE, EXACT, GuessMatcher
+from metrics import Metrics
+from outbox import DISCONNECT, POLICIES, Outbox, Overflow
+from recorder import BROADCAST, IN, OUT, Recorder, Recording
+from scheduler import Scheduler
+from spectators import SpectatorFront, SpectatorServer
+from word_bank import MAX_WORD_LENGTH, WordBank
 
 
 CLIENT_PING_TIME = 5
+# nothing heard back for this long and the connection is dropped
+CLIENT_TIMEOUT = 3 * CLIENT_PING_TIME
 SERVER_PORT = 16324
+DEFAULT_BACKLOG = 128
+DEFAULT_MAX_CONNECTIONS = 10000
+DEFAULT_OUTBOX_BYTES = 4 * 1024 * 1024
+LOBBY_UPDATE_DELAY = 0.5
+LOBBY_REFRESH_INTERVAL = 60
+CLOSE_GUESS_DISTANCE = 2
+ROUND_TIME = 120
+# a letter of the word is shown this often, until half of them are
+HINT_INTERVAL = 20
+DEFAULT_ROOM = "lobby"
+MAX_ROOM_NAME = 32
+WORKER_RESTART_DELAY = 1
+# seconds a worker has to write out its recordings once told to stop
+WORKER_STOP_TIMEOUT = 5
+DEFAULT_HTTP_PORT = 8080
+DEFAULT_STATS_INTERVAL = 60
+LOG_FORMAT = "%(asctime)s %(levelname)-7s [%(name)s] %(message)s"
+WORD_LIST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "WordList.txt")
+
+# Strokes, fills and clears, relayed to everyone else so they can redraw them
+CANVAS_PACKETS = (b"STBG", b"STPT", b"STEN", b"FILL", b"CLER", b"UNDO", b"REDO")
+log = logging.getLogger("server")
+game_log = logging.getLogger("server.game")
+client_log = logging.getLogger("server.client")
+supervisor_log = logging.getLogger("server.supervisor")
+
+
+def room_name(name: str) -> str:
+    return name.strip()[:MAX_ROOM_NAME] or DEFAULT_ROOM
+
+
+def room_worker(name: str, workers: int) -> int:
+    # crc32 rather than hash(), it has to come out the same in every process
+    return zlib.crc32(room_name(name).encode()) % workers
+
+
+def worker_port(index: int) -> int:
+    # the front acceptor has SERVER_PORT, workers get the ports after it
+    return SERVER_PORT + 1 + index
+
+
+def worker_http_port(http_port: int, index: int) -> int:
+    # likewise the supervisor's spectator port and the workers' after it
+    return http_port + 1 + index
+
+
+def stop_on_sigterm():
+    """
+    Makes SIGTERM, which the Supervisor stops its workers with, cancel the running
+    task like ctrl+c would, so finally blocks still get to run
+    """
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel
+        )
+    except NotImplementedError:
+        # windows, where a terminated process gets no say in it anyway
+        ...
+
+
+def word_hint(word: str, revealed) -> str:
+    """
+    :param revealed: positions of the letters to show
+    :return: the word with every other letter as an underscore, spaces are kept
+    """
+    return "".join(
+        char if char == " " or index in revealed else "_"
+        for index, char in enumerate(word)
+    )
 
 
 class Game:
-    def __init__(self, server):
+    def __init__(self, room, words: WordBank, guesses: GuessMatcher):
         self.current_word = ""
-        self.server: Server = server
+        self.room: Room = room
         self.game_is_running = False
+        # shared by every room, the shuffle bag still never repeats a word in one
+        self.words = words
+        self.guesses = guesses
+        # server time the current round ends, the clients count down to it
+        self.round_end = None
+        self._round_timer = None
+        self._hint_timer = None
+        self._revealed = set()
 
     def load_random_word(self):
-        with open("WordList.txt") as file:
-            words = file.read().split("\n")
-
-        words = [_.strip() for _ in words]
-        word = random.choice(words)
+        word = self.words.next_word()
         self.current_word = word
-        print(f" [ \033[35m GAME \033[0m ] Chosen the word '{word}'")
+        game_log.info("%s: chosen the word '%s'", self.room.name, word)
+
+        self._revealed = set()
+        if self.game_is_running:
+            self.room.send_word_refresh(word_hint(word, self._revealed))
+
+    def remove_current_word(self, player):
+        word = self.current_word
+        if word and self.words.remove(word):
+            game_log.info("%s removed the word '%s'", player.name, word)
+            self.load_random_word()
+
+    def add_word(self, word, player):
+        if self.words.append(word):
+            game_log.info("%s added the word %r", player.name, word)
+        else:
+            player.send_chat_message(f"Could not add '{word[:MAX_WORD_LENGTH]}'")
 
     def start_game(self):
-        self.load_random_word()
         self.game_is_running = True
-        self.server.send_word_refresh("lm_ w__n yo_ __e t__s")
+        self.next_round()
+
+    def skip_word(self):
+        if self.game_is_running:
+            self.next_round()
+        else:
+            self.load_random_word()
+
+    def next_round(self):
+        self._cancel_timers()
+        # a blank canvas for the new drawing, late joiners no longer replay the old one
+        self.room.clear_canvas()
+        self.load_random_word()
+
+        scheduler = self.room.scheduler
+        self.round_end = time.time() + ROUND_TIME
+        self._round_timer = scheduler.call_later(ROUND_TIME, self._round_over)
+        self._hint_timer = scheduler.call_every(HINT_INTERVAL, self._reveal_letter)
+
+        self.room.broadcast(self.round_packet(), key=b"ROND")
+
+    def _reveal_letter(self):
+        hidden = [
+            index
+            for index, char in enumerate(self.current_word)
+            if char != " " and index not in self._revealed
+        ]
+        if len(self._revealed) >= (len(hidden) + len(self._revealed)) // 2:
+            return
+
+        self._revealed.add(random.choice(hidden))
+        self.room.send_word_refresh(word_hint(self.current_word, self._revealed))
+
+    def round_packet(self):
+        return protocol.encode(b"ROND", self.round_end)
+
+    def catch_up(self, player):
+        # someone joining mid round gets the deadline and the letters shown so far
+        if self.game_is_running:
+            player.send_packet(self.round_packet())
+            player.send_packet(
+                protocol.encode(b"WORD", word_hint(self.current_word, self._revealed))
+            )
+
+    def _round_over(self):
+        self._round_timer = None
+        if not self.game_is_running:
+            return
+
+        self.room.send_message_to_all(f"Time is up! The word was {self.current_word}")
+        self.next_round()
+
+    def stop(self):
+        self.game_is_running = False
+        self.round_end = None
+        self._cancel_timers()
+
+    def _cancel_timers(self):
+        for timer in (self._round_timer, self._hint_timer):
+            if timer is not None:
+                timer.cancel()
+        self._round_timer = self._hint_timer = None
 
     def check_word(self, guess, player):
         if not self.game_is_running:
@@ -34,191 +210,829 @@ class Game:
                 "You cant guess yet! The game isn't running!"
             )
 
-        guess.replace("_", " ")
+        result = self.guesses.check(guess, self.current_word)
 
-        if self.current_word == guess:
+        if result == EXACT:
             player.send_chat_message(f"_WON {player.name}: {guess}")
-            self.server.send_message_to_all(
+            self.room.send_message_to_all(
                 f"_LOST {player.name}: {guess}", except_=player
             )
 
         else:
-            self.server.send_message_to_all(f"{player.name}: {guess}")
+            self.room.send_message_to_all(f"{player.name}: {guess}")
 
+            if result == CLOSE:
+                player.send_chat_message(f"'{guess}' is close!")
 
-class ServerTimeouts(threading.Thread):
-    def __init__(self, server):
-        super(ServerTimeouts, self).__init__()
-        self.server: Server = server
 
-        self.lobby_update_time = time.time()
+class Room:
+    """
+    One game and the players in it, everything a player sends only reaches their room
+    """
 
-    def run(self) -> None:
-        while True:
-            time.sleep(1)
-            t = time.time()
+    def __init__(self, name, server):
+        self.name = name
+        self.clients: list[Connection] = []
+        self.metrics: Metrics = server.metrics
+        self.scheduler: Scheduler = server.scheduler
+        self.game = Game(self, server.words, server.guesses)
+        # every packet in and out of the room, if the server records
+        self.recording: Recording | None = (
+            server.recorder.open(name) if server.recorder is not None else None
+        )
+        self._lobby_update = None
+        self._lobby_packet = None
+
+        # PNG images of the canvas for the HTTP spectators, made once someone watches
+        self.spectators = None
+        # every canvas event since the last clear, lets late joiners catch up
+        self.canvas_events: list[bytes] = []
+
+    def join(self, client):
+        if self.recording is not None:
+            # recorded here rather than as it came in, they were in no room back then
+            self.recording.record(IN, (b"JOIN", [client.name, self.name]), client.peer)
+
+        self.clients.append(client)
+
+        for event in list(self.canvas_events):
+            client.send_canvas_event(event)
 
-            if self.lobby_update_time + 60 > t:
-                print(" [ \033[32mMStime\033[0m ] Sending lobby info")
-                self.server.update_all_clients()
-                self.lobby_update_time = t
+        self.game.catch_up(client)
+        self.schedule_lobby_update()
+
+    def leave(self, client):
+        self.clients.remove(client)
+        self.schedule_lobby_update()
+
+    def broadcast(self, data: bytes, except_=None, key=None):
+        """
+        Queues an encoded packet for everyone in the room, nobody waits on anyone's socket
+        :param except_: client to leave out
+        :param key: lets a full outbox replace an older packet with the same key
+        """
+        started = time.perf_counter()
+        recipients = 0
+
+        if self.recording is not None:
+            self.recording.record(BROADCAST, data)
+
+        for client in list(self.clients):
+            if client is not except_:
+                client.queue_packet(data, key)
+                recipients += 1
+
+        # counted once for the whole room rather than once per client
+        self.metrics.broadcasted(data, recipients, time.perf_counter() - started)
+
+    def send_message_to_all(self, message, except_=None):
+        self.broadcast(protocol.encode(b"CHAT", message), except_=except_)
+
+    def send_word_refresh(self, word):
+        self.broadcast(protocol.encode(b"WORD", word), key=b"WORD")
+
+    def add_canvas_event(self, event, sender=None):
+        if event[:4] == b"CLER":
+            self.canvas_events.clear()
+        self.canvas_events.append(event)
+
+        self.broadcast(event, except_=sender)
+        if self.spectators is not None:
+            self.spectators.canvas_event(event)
+
+    def clear_canvas(self, rgb=CANVAS_BACKGROUND):
+        self.add_canvas_event(protocol.encode(b"CLER", NO_SENDER, pack_rgb(rgb)))
+
+    def update_all_clients(self):
+        self._lobby_packet = None
+        self.broadcast(self.lobby_packet(), key=b"LOBY")
+
+    def lobby_packet(self):
+        # Encoded once per update and shared, with thousands of players this matters
+        if self._lobby_packet is None:
+            self._lobby_packet = protocol.encode(
+                b"LOBY", [client.name for client in self.clients]
+            )
+        return self._lobby_packet
+
+    def schedule_lobby_update(self):
+        # Joins and leaves come in bursts, one lobby update shortly after covers them all
+        if self._lobby_update is None:
+            self._lobby_update = self.scheduler.call_later(
+                LOBBY_UPDATE_DELAY, self._scheduled_lobby_update
+            )
+
+    def _scheduled_lobby_update(self):
+        self._lobby_update = None
+        self.update_all_clients()
+
+    def close(self):
+        # the last player left, nothing of the room should fire after this
+        self.game.stop()
+        if self._lobby_update is not None:
+            self._lobby_update.cancel()
+            self._lobby_update = None
+        if self.recording is not None:
+            self.recording.close()
 
 
 class Server:
-    def __init__(self):
+    def __init__(
+        self,
+        backlog=DEFAULT_BACKLOG,
+        max_connections=DEFAULT_MAX_CONNECTIONS,
+        outbox_bytes=DEFAULT_OUTBOX_BYTES,
+        overflow_policy=DISCONNECT,
+        close_distance=CLOSE_GUESS_DISTANCE,
+        port=SERVER_PORT,
+        shard=None,
+        http_port=None,
+        stats_interval=DEFAULT_STATS_INTERVAL,
+        record_dir=None,
+    ):
+        """
+        :param http_port: serves spectators and /stats from the event loop on this port,
+            if given
+        :param stats_interval: seconds between the stats log lines, 0 for none
+        :param record_dir: every room is recorded to a file in here, if given
+        :param shard: (index, workers) when this is one of several worker processes,
+            rooms owned by another worker are redirected there
+        """
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.bind(("", SERVER_PORT))
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("", port))
+        self.port = port
+        self.shard = shard
+        self.http_port = http_port
         self.running = True
-        self.clients: list[Client] = []
+        # every connection, in a room or not yet
+        self.clients: list[Connection] = []
+        self.rooms: dict[str, Room] = {}
+        self.backlog = backlog
+        self.max_connections = max_connections
+        # every client gets an outbox this big, see outbox.py for the policies
+        self.outbox_bytes = outbox_bytes
+        self.overflow_policy = overflow_policy
 
         self.self_ip = socket.gethostbyname(socket.gethostname())
-        print(" [ \033[32mMS    \033[0m ] Discovered my ip.", self.self_ip)
+        log.info("Discovered my ip %s", self.self_ip)
 
-        self.game = Game(self)
-        self.frame = None
+        # rounds, hints, heartbeats and lobby refreshes all run off this one
+        self.scheduler = Scheduler()
 
-    def send_message_to_all(self, message, except_=None):
-        for client in self.clients:
-            print(client, type(client), except_, type(except_))
-            if client == except_:
-                pass
+        self.metrics = Metrics()
+        self.metrics.gauge("port", lambda: self.port)
+        self.metrics.gauge("clients", lambda: len(self.clients))
+        self.metrics.gauge("rooms", lambda: len(self.rooms))
+        self.metrics.gauge("outboxes", self._outbox_stats)
+        self.metrics.gauge("rtt", self._rtt_stats)
+        self.stats_interval = stats_interval
 
-            client.send_chat_message(message)
+        # written from a thread of its own, see recorder.py
+        self.recorder = Recorder(record_dir) if record_dir else None
+        if self.recorder is not None:
+            self.metrics.gauge("recordings", self.recorder.stats)
 
-    def send_word_refresh(self, word):
-        for client in self.clients:
-            client.send_word_refresh(word)
+        self.words = WordBank(WORD_LIST)
+        # guesses are only ever checked against the current word, no table needed
+        self.guesses = GuessMatcher(max_distance=close_distance)
 
-    def update_all_clients(self):
-        for client in self.clients:
-            client.send_lobby_update()
+    def join_room(self, client, name):
+        """
+        Moves a client into the named room, creating the room if nobody is in it yet
+        """
+        name = room_name(name)
+        self.leave_room(client)
+
+        if self.shard is not None:
+            index, workers = self.shard
+            owner = room_worker(name, workers)
+
+            if owner != index:
+                # they reconnect to the worker that has the room
+                client.send_packet(protocol.encode(b"MOVE", worker_port(owner)))
+                return
+
+        room = self.rooms.get(name)
+        if room is None:
+            room = self.rooms[name] = Room(name, self)
+            log.info("Opened room '%s'", name)
+
+        client.room = room
+        room.join(client)
+
+    def leave_room(self, client):
+        room = client.room
+        if room is None:
+            return
+
+        client.room = None
+        room.leave(client)
+
+        if not room.clients and self.rooms.get(room.name) is room:
+            del self.rooms[room.name]
+            room.close()
+            log.info("Closed room '%s'", room.name)
+
+    def remove_client(self, client):
+        self.leave_room(client)
+        self.clients.remove(client)
+
+    def is_full(self):
+        return len(self.clients) >= self.max_connections
+
+    def _outbox_stats(self):
+        # how far behind the clients are, the slowest one matters most
+        outboxes = [client.outbox for client in list(self.clients)]
+        return {
+            "queued_bytes": sum(outbox.queued_bytes for outbox in outboxes),
+            "max_queued_bytes": max(
+                (outbox.queued_bytes for outbox in outboxes), default=0
+            ),
+            "max_queued_packets": max(map(len, outboxes), default=0),
+            "dropped": sum(outbox.dropped for outbox in outboxes),
+            "coalesced": sum(outbox.coalesced for outbox in outboxes),
+        }
+
+    def _rtt_stats(self):
+        # smoothed round trip times of everyone measured so far
+        rtts = [
+            client.clock.rtt
+            for client in list(self.clients)
+            if client.clock.rtt is not None
+        ]
+        return {
+            "clients": len(rtts),
+            "mean_ms": sum(rtts) / len(rtts) * 1000 if rtts else 0.0,
+            "max_ms": max(rtts, default=0.0) * 1000,
+        }
+
+    def stats(self) -> dict:
+        return self.metrics.snapshot()
+
+    def _log_stats(self):
+        # one JSON line per interval, easy to grep and to feed to something else
+        log.info("stats %s", json.dumps(self.stats(), separators=(",", ":")))
+
+    def _refresh_lobbies(self):
+        # in case an update went missing, e.g. dropped from a full outbox
+        log.debug("Sending lobby info")
+        for room in list(self.rooms.values()):
+            room.update_all_clients()
+
+    def _start_timers(self):
+        self.scheduler.call_every(LOBBY_REFRESH_INTERVAL, self._refresh_lobbies)
+        if self.stats_interval:
+            self.scheduler.call_every(self.stats_interval, self._log_stats)
 
     def run(self):
-        print(" [ \033[32mMS    \033[0m ] Starting server on port", SERVER_PORT)
-        self.sock.listen(1)
+        # One thread per connection, the event loop is the default
+        log.info("Starting threaded server on port %s", self.port)
+        self.sock.listen(self.backlog)
+        self._start_timers()
+        threading.Thread(target=self.scheduler.run, daemon=True).start()
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit())
 
-        while self.running:
-            client, address = self.sock.accept()
-            print(f" [ \033[32mMS    \033[0m ] New connection from {address}")
-            port = f"{str(address[1]):5s}"
+        try:
+            while self.running:
+                client, address = self.sock.accept()
+                if self.is_full():
+                    client.close()
+                    continue
 
-            client = Client(self, client, port)
-            client.start()
-            self.clients.append(client)
+                log.debug("New connection from %s", address)
+                port = f"{str(address[1]):5s}"
 
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                client = Client(self, client, port)
+                client.start()
+                self.clients.append(client)
+        finally:
+            self.close()
 
-class Client(threading.Thread):
-    def __init__(self, master, client, port):
-        super(Client, self).__init__()
+    def run_event_loop(self):
+        # Every connection is served from a single asyncio event loop
+        log.info("Starting server on port %s", self.port)
+        try:
+            asyncio.run(self._serve())
+        except asyncio.CancelledError:
+            log.info("Stopped")
+        finally:
+            self.close()
+
+    def close(self):
+        # whatever the recordings still have queued is written before exiting
+        if self.recorder is not None:
+            self.recorder.close()
+
+    async def _serve(self):
+        stop_on_sigterm()
+        self.sock.setblocking(False)
+        listener = await asyncio.start_server(
+            self._accept, sock=self.sock, backlog=self.backlog
+        )
+
+        self._start_timers()
+        asyncio.create_task(self.scheduler.serve())
+
+        if self.http_port:
+            spectators = SpectatorServer(self, self.http_port, DEFAULT_ROOM)
+            asyncio.create_task(spectators.serve())
 
+        async with listener:
+            await listener.serve_forever()
+
+    async def _accept(self, reader, writer):
+        if self.is_full():
+            writer.close()
+            return
+
+        address = writer.get_extra_info("peername")
+        log.debug("New connection from %s", address)
+        port = f"{str(address[1]):5s}"
+
+        client = EventLoopClient(self, reader, writer, port)
+        self.clients.append(client)
+        try:
+            await client.run()
+        except asyncio.CancelledError:
+            # the server stopping, start_server logs a handler cancelled with it
+            ...
+
+
+class Connection:
+    """
+    Packet handling and sending shared by Client and EventLoopClient, they only differ
+    in how bytes get to and from the socket
+    """
+
+    def __init__(self, master, port, on_put=None):
         self._server: Server = master
-        self._socket: socket.socket = client
+        self.outbox = Outbox(master.outbox_bytes, master.overflow_policy, on_put)
         self._running = True
-        self._last_ping_time = time.time()
+        self._last_pong = time.time()
+        self._ping_sent_at = None
+        self.clock = ClockSync()
+        # pinged straight away, the round trip time is known from the start
+        self._heartbeat = master.scheduler.call_every(
+            CLIENT_PING_TIME, self._heartbeat_tick, first=0
+        )
         self._port = port
+        # the port as a number, tells players apart in recordings
+        self.peer = int(port)
         self._name = "N00B"
+        # set by the server once they JOIN
+        self.room: Room | None = None
+
+    @property
+    def name(self):
+        return self._name
+
+    def handle_packet(self, packet, fields, size):
+        """
+        process_packet, timed and counted in the server's metrics
+        :param size: bytes the packet took up on the wire
+        """
+        started = time.perf_counter()
+
+        room = self.room
+        if room is not None and room.recording is not None:
+            # encoded again by the recorder's thread, not here
+            room.recording.record(IN, (packet, fields), self.peer)
+
+        self.process_packet(packet, fields)
+        self._server.metrics.handled(packet, size, time.perf_counter() - started)
 
-    def process_packet(self, packet):
+    def process_packet(self, packet, fields):
         if packet == b"PONG":
-            self._last_ping_time = time.time()
+            self._last_pong = time.time()
 
-        elif packet == b"WORD":
-            word = self._read_string_secure()
-            self._server.game.check_word(word, self)
+            # only a reply to the ping we sent counts, anything else would skew it
+            if fields[0] == self._ping_sent_at:
+                self._ping_sent_at = None
+                self._server.metrics.round_trip(self.clock.pong(*fields))
+
+        elif packet == b"PING":
+            self.send_packet(protocol.encode(b"PONG", fields[0], time.time()))
 
         elif packet == b"JOIN":
-            name = self._read_string_secure()
+            name, room = fields
             self._name = name
-            print(f" [ \033[34mC{self._port}\033[0m ] Has named themselves {name}")
+            client_log.debug("C%s has named themselves %s", self._port, name)
+
+            self._server.join_room(self, room)
+
+        elif self.room is None:
+            client_log.warning("C%s sent %s before joining", self._port, packet)
+
+        elif packet == b"WORD":
+            self.room.game.check_word(fields[0], self)
 
         elif packet == b"STRT":
-            self._server.game.start_game()
+            self.room.game.start_game()
 
         elif packet == b"SKIP":
-            self._server.game.load_random_word()
+            self.room.game.skip_word()
+
+        elif packet == b"WDEL":
+            self.room.game.remove_current_word(self)
+
+        elif packet == b"WADD":
+            self.room.game.add_word(fields[0], self)
 
         elif packet == b"FRME":
-            length = self._socket.recv(2)
-            length = int.from_bytes(length, "big")
+            # spectators get the canvas drawn from the canvas events, frames add nothing
+            ...
 
-            frame = self._socket.recv(length)
-            self._server.frame = frame
+        elif packet in CANVAS_PACKETS:
+            fields = checked_fields(packet, fields)
+            if fields is None:
+                client_log.warning("C%s filled outside the canvas", self._port)
+                return
+
+            # encoded once here with who sent it, every other player gets the same bytes
+            self.room.add_canvas_event(
+                protocol.encode(packet, self.peer, *fields[1:]), self
+            )
 
         else:
-            print("WHAT THE FUUUUUUUUUUCK")
-            print(f"Client {self._port} did a dumb and sent", packet)
+            client_log.warning("C%s did a dumb and sent %s", self._port, packet)
 
-    def send_word_refresh(self, word):
-        self._socket.send(b"WORD")
-        self._send_string_secure(word)
+    def send_canvas_event(self, event):
+        self.send_packet(event)
+
+    def _heartbeat_tick(self):
+        if time.time() - self._last_pong > CLIENT_TIMEOUT:
+            client_log.warning("C%s stopped answering pings", self._port)
+            self._heartbeat.cancel()
+            return self._abort()
+
+        self.send_ping()
 
     def send_ping(self):
-        self._socket.send(b"PING")
+        now = time.time()
+        self._ping_sent_at = now
+        self.send_packet(protocol.encode(b"PING", now), key=b"PING")
 
     def send_chat_message(self, message):
-        self._socket.send(b"CHAT")
-        self._send_string_secure(message)
+        self.send_packet(protocol.encode(b"CHAT", message))
+
+    def send_packet(self, data: bytes, key=None):
+        """
+        Queues an encoded packet, the writer sends it once the ones before it are out
+        """
+        self._server.metrics.sent(data)
 
-    def send_lobby_update(self):
-        clients = self._server.clients
+        room = self.room
+        if room is not None and room.recording is not None:
+            room.recording.record(OUT, data, self.peer)
 
-        self._socket.send(b"LOBY")
-        self._send_int_secure(len(clients))
+        self.queue_packet(data, key)
 
-        for client in clients:
-            self._send_string_secure(client.name)
+    def queue_packet(self, data: bytes, key=None):
+        """
+        send_packet without counting it, for callers that count a whole batch at once
+        """
+        try:
+            self.outbox.put(data, key)
+        except Overflow as error:
+            client_log.warning("C%s can not keep up, %s", self._port, error)
+            self.outbox.close()
+            self._abort()
+
+    def _abort(self):
+        # Cuts the connection, the reader notices and cleans up
+        raise NotImplementedError
+
+
+class Client(Connection, threading.Thread):
+    def __init__(self, master, client, port):
+        threading.Thread.__init__(self)
+        Connection.__init__(self, master, port)
+
+        self._socket: socket.socket = client
+        self._reader = protocol.PacketReader(client)
+        self._writer = threading.Thread(target=self._write_outbox, daemon=True)
 
     def death_spiral(self):
         self._running = False
+        self._heartbeat.cancel()
+        self.outbox.close()
+        self._reader.close()
         self._socket.close()
-        self._server.clients.remove(self)
-        print(f" \033[31m[ \033[34mC{self._port}\033[0m \033[31m]\33[0m Closing thread")
-
-    def _send_string_secure(self, string: str):
-        self._socket.send(len(string).to_bytes(2, "big"))
-        self._socket.send(string.encode())
-
-    def _read_string_secure(self):
-        length = self._socket.recv(2)
-        length = int.from_bytes(length, "big")
+        self._server.remove_client(self)
+        client_log.debug("C%s closing thread", self._port)
 
-        data = self._socket.recv(length)
-        return data.decode()
+    def _abort(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            ...
 
-    def _send_int_secure(self, number: int):
-        self._socket.send(number.to_bytes(4, "big"))
+    def _write_outbox(self):
+        # The only thread that sends on this socket, everything queued goes out at once
+        while self._running and not self.outbox.closed:
+            packets = self.outbox.take(timeout=1)
+            if not packets:
+                continue
 
-    def _read_int_secure(self):
-        data = self._socket.recv(4)
-        data = int.from_bytes(data, "big")
-        return data
+            try:
+                self._socket.sendall(b"".join(packets))
+            except OSError:
+                return self._abort()
 
     def run(self) -> None:
-        self._server.update_all_clients()
+        self._writer.start()
 
         while self._running:
-            self._socket.settimeout(0.2)
-
             try:
-                data = self._socket.recv(4)
-            except socket.timeout:
-                ...
+                packet = self._reader.read_packet()
             except ConnectionResetError:
-                print(f" [ \033[34mC{self._port}\033[0m ] Connection reset.")
+                client_log.debug("C%s connection reset", self._port)
                 return self.death_spiral()
             except ConnectionAbortedError:
-                print(f" [ \033[34mC{self._port}\033[0m ] Connection aborted.")
+                client_log.debug("C%s connection aborted", self._port)
+                return self.death_spiral()
+            except protocol.ProtocolError as error:
+                client_log.warning("C%s bad data, %s", self._port, error)
                 return self.death_spiral()
-            else:
-                self._socket.settimeout(None)
-                if data:
-                    self.process_packet(data)
 
-            t = time.time()
-            if t > self._last_ping_time + CLIENT_PING_TIME:
-                self.send_ping()
+            self.handle_packet(*packet, self._reader.last_size)
+
+
+class EventLoopClient(Connection):
+    """
+    A connection served from the server's event loop rather than its own thread,
+    has the same interface as Client so the game does not care which it talks to
+    """
+
+    def __init__(self, master, reader, writer, port):
+        self._outbox_ready = asyncio.Event()
+        super(EventLoopClient, self).__init__(master, port, self._outbox_ready.set)
+
+        self._reader: asyncio.StreamReader = reader
+        self._writer: asyncio.StreamWriter = writer
+        self._parser = protocol.PacketParser()
+
+    def death_spiral(self):
+        self._running = False
+        self._heartbeat.cancel()
+        self.outbox.close()
+        self._outbox_ready.set()
+        self._writer.close()
+        self._server.remove_client(self)
+        client_log.debug("C%s closing connection", self._port)
+
+    def _abort(self):
+        self._writer.transport.abort()
+
+    async def _write_outbox(self):
+        # Waits for the socket to drain before sending more, meanwhile the outbox fills
+        while self._running:
+            await self._outbox_ready.wait()
+            self._outbox_ready.clear()
+
+            packets = self.outbox.take(timeout=0)
+            if not packets:
+                continue
+
+            try:
+                self._writer.write(b"".join(packets))
+                await self._writer.drain()
+            except ConnectionError:
+                return self._abort()
+
+    async def run(self):
+        writer = asyncio.create_task(self._write_outbox())
+        try:
+            await self._read()
+        finally:
+            writer.cancel()
+
+    async def _read(self):
+        while self._running:
+            try:
+                data = await self._reader.read(65536)
+            except ConnectionError:
+                data = b""
+
+            if not data:
+                client_log.debug("C%s connection lost", self._port)
+                return self.death_spiral()
+
+            self._parser.feed(data)
+
+            try:
+                while (packet := self._parser.next_packet()) is not None:
+                    self.handle_packet(*packet, self._parser.last_size)
+            except protocol.ProtocolError as error:
+                client_log.warning("C%s bad data, %s", self._port, error)
+                return self.death_spiral()
+
+
+def run_worker(index, workers, options, log_level, http_port):
+    # a spawned process starts without the parent's logging set up
+    logging.basicConfig(level=log_level, format=LOG_FORMAT)
+    Server(
+        port=worker_port(index),
+        shard=(index, workers),
+        http_port=worker_http_port(http_port, index) if http_port else None,
+        **options,
+    ).run_event_loop()
+
+
+class Supervisor:
+    """
+    Runs a worker process per core, each owning the rooms that hash to it
+
+    Clients connect to the front acceptor on SERVER_PORT, which reads their JOIN and
+    sends back a MOVE to the port of the worker owning their room. Workers that die
+    are started again.
+
+    Spectators likewise go to the supervisor's http_port and are redirected to the
+    worker's, /stats there has the stats of every worker.
+    """
+
+    def __init__(self, workers, backlog=DEFAULT_BACKLOG, http_port=None, **options):
+        """
+        :param http_port: the spectator port, workers get the ports after it
+        :param options: passed on to every worker's Server
+        """
+        self.workers = workers
+        self.backlog = backlog
+        self.http_port = http_port
+        self.options = dict(options, backlog=backlog)
+        self.processes: list[multiprocessing.Process | None] = [None] * workers
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("", SERVER_PORT))
+
+    def run(self):
+        supervisor_log.info(
+            "Starting %s workers, front acceptor on port %s", self.workers, SERVER_PORT
+        )
+        try:
+            asyncio.run(self._serve())
+        except asyncio.CancelledError:
+            supervisor_log.info("Stopped")
+
+    def _start_worker(self, index):
+        # spawned rather than forked, a fork would inherit the running event loop
+        process = multiprocessing.get_context("spawn").Process(
+            target=run_worker,
+            args=(
+                index,
+                self.workers,
+                self.options,
+                logging.getLogger().getEffectiveLevel(),
+                self.http_port,
+            ),
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        supervisor_log.info(
+            "Worker %s (pid %s) on port %s", index, process.pid, worker_port(index)
+        )
+
+    async def _watch_workers(self):
+        while True:
+            for index, process in enumerate(self.processes):
+                if process is None or not process.is_alive():
+                    if process is not None:
+                        supervisor_log.warning(
+                            "Worker %s exited with %s, restarting",
+                            index,
+                            process.exitcode,
+                        )
+                    self._start_worker(index)
+
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+
+    async def _serve(self):
+        stop_on_sigterm()
+        self.sock.setblocking(False)
+        listener = await asyncio.start_server(
+            self._redirect, sock=self.sock, backlog=self.backlog
+        )
+        watcher = asyncio.create_task(self._watch_workers())
+
+        if self.http_port:
+            spectators = SpectatorFront(
+                self.http_port,
+                DEFAULT_ROOM,
+                lambda name: worker_http_port(
+                    self.http_port, room_worker(name, self.workers)
+                ),
+                [worker_http_port(self.http_port, i) for i in range(self.workers)],
+            )
+            asyncio.create_task(spectators.serve())
+
+        async with listener:
+            try:
+                await listener.serve_forever()
+            finally:
+                watcher.cancel()
+                for process in self.processes:
+                    if process is not None:
+                        process.terminate()
+                # they write out their recordings before exiting
+                for process in self.processes:
+                    if process is not None:
+                        process.join(WORKER_STOP_TIMEOUT)
+
+    async def _redirect(self, reader, writer):
+        parser = protocol.PacketParser()
+
+        try:
+            while (packet := parser.next_packet()) is None:
+                data = await asyncio.wait_for(reader.read(4096), CLIENT_PING_TIME)
+                if not data:
+                    return
+                parser.feed(data)
+
+            opcode, fields = packet
+            if opcode == b"JOIN":
+                owner = room_worker(fields[1], self.workers)
+                writer.write(protocol.encode(b"MOVE", worker_port(owner)))
+                await writer.drain()
+
+        except (asyncio.TimeoutError, ConnectionError, protocol.ProtocolError):
+            ...
+        finally:
+            writer.close()
 
 
 if __name__ == "__main__":
-    ms = Server()
-    ms.run()
+    parser = argparse.ArgumentParser(description="PaintGame server")
+    parser.add_argument(
+        "--threaded",
+        action="store_true",
+        help="serve every connection from its own thread instead of one event loop",
+    )
+    parser.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG)
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS)
+    parser.add_argument(
+        "--outbox-kb",
+        type=int,
+        default=DEFAULT_OUTBOX_BYTES // 1024,
+        help="unsent data a client may have waiting before --overflow applies",
+    )
+    parser.add_argument("--overflow", choices=POLICIES, default=DISCONNECT)
+    parser.add_argument(
+        "--close-distance",
+        type=int,
+        default=CLOSE_GUESS_DISTANCE,
+        help="typos a guess may have and still be told it is close",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="worker processes to spread rooms over, 0 for one per core",
+    )
+    parser.add_argument(
+        "--http-port",
+        type=int,
+        default=DEFAULT_HTTP_PORT,
+        help="port of the spectator page, stream and /stats, 0 turns it off",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=DEFAULT_STATS_INTERVAL,
+        help="seconds between the stats lines in the log, 0 turns them off",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="DIRECTORY",
+        help="record every room to a file in this directory, see replay.py",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+        default="INFO",
+        help="DEBUG also logs every connection coming and going",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format=LOG_FORMAT)
+
+    options = dict(
+        backlog=args.backlog,
+        max_connections=args.max_connections,
+        outbox_bytes=args.outbox_kb * 1024,
+        overflow_policy=args.overflow,
+        close_distance=args.close_distance,
+        stats_interval=args.stats_interval,
+        record_dir=args.record,
+    )
+    workers = args.workers or os.cpu_count() or 1
+
+    if workers > 1:
+        Supervisor(workers, http_port=args.http_port, **options).run()
+    elif args.threaded:
+        Server(**options).run()
+    else:
+        Server(http_port=args.http_port, **options).run_event_loop()
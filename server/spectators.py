@@ -0,0 +1,374 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from urllib.parse import quote, unquote
+
+import numpy
+import pygame
+
+import protocol
+from canvas_replay import (
+    CANVAS_BACKGROUND,
+    CANVAS_SIZE,
+    SharedCanvas,
+    event_from_packet,
+)
+
+SPECTATOR_FPS = 10
+# undo steps the server keeps of a watched canvas, to apply relayed UNDOs
+MIRROR_UNDO_BUDGET = 16 * 1024 * 1024
+INDEX_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "index.html")
+BOUNDARY = b"frame"
+
+log = logging.getLogger("server.http")
+
+
+def encode_png(rgb: numpy.ndarray, level: int = 1) -> bytes:
+    """
+    :param rgb: (height, width, 3) uint8 array
+    """
+    height, width, _ = rgb.shape
+
+    # every row starts with its filter type, 0 is none
+    rows = numpy.zeros((height, width * 3 + 1), dtype=numpy.uint8)
+    rows[:, 1:] = rgb.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data))
+        )
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows.tobytes(), level))
+        + chunk(b"IEND", b"")
+    )
+
+
+class CanvasMirror:
+    """
+    A room's canvas drawn on the server from the same canvas events the players get,
+    through the same SharedCanvas, so spectators see exactly what the players see
+    """
+
+    def __init__(self, events=()):
+        """
+        :param events: encoded canvas packets so far, e.g. Room.canvas_events
+        """
+        self._canvas = pygame.Surface(CANVAS_SIZE)
+        self._canvas.fill(CANVAS_BACKGROUND)
+        self._shared = SharedCanvas(self._canvas, budget=MIRROR_UNDO_BUDGET)
+
+        for event in events:
+            self.apply(event)
+
+    def apply(self, packet: bytes) -> bool:
+        """
+        :return: True if the canvas changed
+        """
+        event = event_from_packet(*protocol.decode(packet))
+        if event is None:
+            return False
+
+        sender, event = event
+        return self._shared.apply(event, sender) is not None
+
+    def close(self):
+        # stops the histories' threads
+        self._shared.close()
+
+    def frame(self) -> numpy.ndarray:
+        """
+        :return: a (height, width, 3) RGB copy of the canvas
+        """
+        return pygame.surfarray.array3d(self._canvas).transpose(1, 0, 2)
+
+
+class FrameFeed:
+    """
+    A room's canvas as PNG images for spectators
+
+    The canvas is only drawn on the server while someone watches, each frame is encoded
+    once however many do. Viewers always pick up the newest image, one that is slow to
+    read simply misses the frames it was too slow for instead of having them pile up.
+
+    The loop only queues the room's canvas events, drawing them and encoding the image
+    both happen on an executor thread.
+    """
+
+    def __init__(self, room, fps: int = SPECTATOR_FPS):
+        """
+        :param room: anything with the canvas_events of a Room
+        """
+        self._room = room
+        self._interval = 1 / fps
+
+        self.viewers = 0
+        self.version = 0
+        self.image: bytes | None = None
+        # only touched from the executor while the producer runs
+        self.mirror: CanvasMirror | None = None
+
+        # deque appends and pops are thread safe
+        self._pending: deque[bytes] = deque()
+        self._changed = asyncio.Event()
+        self._published = asyncio.Event()
+        self._producer: asyncio.Task | None = None
+
+    def canvas_event(self, packet: bytes):
+        # called for every canvas event in the room, only drawn while watched
+        if self._producer is not None:
+            self._pending.append(packet)
+            self._changed.set()
+
+    async def images(self):
+        """
+        Yields the newest image every time there is a new one
+        """
+        self.viewers += 1
+        if self._producer is None:
+            # caught up from the start of the round, the room keeps the events since
+            self._pending = deque(self._room.canvas_events)
+            self._producer = asyncio.create_task(self._produce())
+            self._changed.set()
+
+        seen = None
+        try:
+            while True:
+                if self.version == seen or self.image is None:
+                    await self._published.wait()
+                    continue
+
+                seen = self.version
+                yield self.image
+        finally:
+            self.viewers -= 1
+            if not self.viewers:
+                # wakes the producer to stop, unless someone else starts watching first
+                self._changed.set()
+
+    async def _produce(self):
+        loop = asyncio.get_running_loop()
+
+        try:
+            while True:
+                await self._changed.wait()
+                self._changed.clear()
+
+                if not self.viewers:
+                    break
+
+                started = time.monotonic()
+                image = await loop.run_in_executor(None, self._draw)
+                if image is None:
+                    continue
+
+                self.image = image
+                self.version += 1
+
+                published, self._published = self._published, asyncio.Event()
+                published.set()
+
+                await asyncio.sleep(
+                    max(self._interval - (time.monotonic() - started), 0)
+                )
+        finally:
+            self._producer = None
+            self._pending.clear()
+            self.image = None
+            if self.mirror is not None:
+                self.mirror.close()
+                self.mirror = None
+
+    def _draw(self) -> bytes | None:
+        """
+        Draws the queued canvas events, on the executor
+        :return: the canvas as a PNG, None if nothing changed since the last one
+        """
+        changed = self.mirror is None
+        if changed:
+            self.mirror = CanvasMirror()
+
+        while self._pending:
+            changed |= self.mirror.apply(self._pending.popleft())
+
+        return encode_png(self.mirror.frame()) if changed else None
+
+
+class SpectatorServer:
+    """
+    Serves index.html and a live view of each room over HTTP
+
+        /<room>/        the page
+        /<room>/video   multipart PNG stream of the room's canvas
+        /stats          the server's metrics as JSON
+    """
+
+    def __init__(self, server, port: int, default_room: str):
+        self._server = server
+        self.port = port
+        self._default_room = default_room
+
+    async def serve(self):
+        listener = await asyncio.start_server(self._handle, port=self.port)
+        log.info("Spectators on port %s", self.port)
+
+        async with listener:
+            await listener.serve_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            method, path, _ = (
+                request.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+            )
+
+            if method != "GET":
+                return await self._respond(writer, 405, "text/plain", b"GET only")
+
+            parts = [unquote(part) for part in path.split("?")[0].split("/")]
+
+            if path == "/":
+                writer.write(
+                    f"HTTP/1.1 302 Found\r\nLocation: /{self._default_room}/\r\n"
+                    f"Content-Length: 0\r\nConnection: close\r\n\r\n".encode()
+                )
+
+            elif path == "/stats":
+                await self._respond(
+                    writer,
+                    200,
+                    "application/json",
+                    json.dumps(await self._stats()).encode(),
+                )
+
+            elif len(parts) == 3 and parts[2] in ("", "index.html", "video"):
+                await self._room(writer, request, parts[1], parts[2])
+
+            else:
+                await self._respond(writer, 404, "text/plain", b"Not found")
+
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ConnectionError,
+            ValueError,
+        ):
+            ...
+        finally:
+            writer.close()
+
+    async def _stats(self) -> dict:
+        return self._server.stats()
+
+    async def _room(self, writer, request: bytes, name: str, page: str):
+        if page != "video":
+            with open(INDEX_PAGE, "rb") as file:
+                return await self._respond(writer, 200, "text/html", file.read())
+
+        room = self._server.rooms.get(name)
+        if room is None:
+            return await self._respond(writer, 404, "text/plain", b"No such room")
+        await self._stream(writer, room)
+
+    @staticmethod
+    async def _respond(writer, status, content_type, body):
+        reason = {200: "OK", 404: "Not Found", 405: "Method Not Allowed"}[status]
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    @staticmethod
+    async def _stream(writer, room):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: multipart/x-mixed-replace; boundary=" + BOUNDARY + b"\r\n"
+            b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n"
+        )
+
+        if room.spectators is None:
+            room.spectators = FrameFeed(room)
+
+        async with contextlib.aclosing(room.spectators.images()) as images:
+            async for image in images:
+                writer.write(
+                    b"--" + BOUNDARY + b"\r\nContent-Type: image/png\r\n"
+                    b"Content-Length: " + str(len(image)).encode() + b"\r\n\r\n"
+                )
+                writer.write(image)
+                writer.write(b"\r\n")
+                # waiting here is what makes a slow viewer skip frames
+                await writer.drain()
+
+
+class SpectatorFront(SpectatorServer):
+    """
+    The spectator port of a Supervisor, which has no rooms of its own
+
+    A room's page is redirected to the spectator port of the worker that owns the room,
+    like players are with MOVE. /stats has every worker's stats, fetched from them.
+    """
+
+    def __init__(self, port: int, default_room: str, room_port, worker_ports):
+        """
+        :param room_port: room name -> spectator port of the worker that owns it
+        :param worker_ports: spectator ports of all the workers
+        """
+        super().__init__(None, port, default_room)
+        self._room_port = room_port
+        self._worker_ports = worker_ports
+
+    async def _stats(self) -> dict:
+        workers = await asyncio.gather(
+            *(_fetch_stats(port) for port in self._worker_ports)
+        )
+        return {"workers": workers}
+
+    async def _room(self, writer, request: bytes, name: str, page: str):
+        # same host as they asked for, only the port changes
+        host = writer.get_extra_info("sockname")[0]
+        for line in request.split(b"\r\n")[1:]:
+            key, _, value = line.decode("latin-1").partition(":")
+            if key.strip().lower() == "host":
+                host = value.strip()
+                # the port cut off, IPv6 addresses keep their brackets
+                if host.rfind(":") > host.rfind("]"):
+                    host = host[: host.rfind(":")]
+                break
+
+        location = f"http://{host}:{self._room_port(name)}/{quote(name)}/{page}"
+        writer.write(
+            f"HTTP/1.1 302 Found\r\nLocation: {location}\r\n"
+            f"Content-Length: 0\r\nConnection: close\r\n\r\n".encode()
+        )
+        await writer.drain()
+
+
+async def _fetch_stats(port: int) -> dict | None:
+    # None for a worker that is down or restarting
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection("127.0.0.1", port), 2
+        )
+        try:
+            writer.write(b"GET /stats HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            response = await asyncio.wait_for(reader.read(), 2)
+        finally:
+            writer.close()
+
+        return json.loads(response.split(b"\r\n\r\n", 1)[1])
+    except (asyncio.TimeoutError, ConnectionError, OSError, IndexError, ValueError):
+        return None
@@ -0,0 +1,250 @@
+import contextlib
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    # windows, saves from other processes are still read in but not waited for
+    fcntl = None
+
+# longest word or phrase players may add
+MAX_WORD_LENGTH = 32
+# edits to the list
+REMOVE = "remove"
+APPEND = "append"
+# held by whoever is saving the list, next to it
+LOCK_EXTENSION = ".lock"
+
+log = logging.getLogger("server.words")
+
+
+def normalize_word(word: str) -> str | None:
+    """
+    :return: the word trimmed with single spaces between its parts, None if it is blank,
+        too long or has line breaks or other control characters in it
+    """
+    if any(unicodedata.category(char) == "Cc" for char in word):
+        return None
+
+    word = " ".join(word.split())
+    if not word or len(word) > MAX_WORD_LENGTH:
+        return None
+    return word
+
+
+class WordBank:
+    """
+    The word list, read once and kept in memory
+
+    Words are handed out from a shuffle bag, every word comes up once in a random order
+    before any of them repeat. Edits are written back to the file atomically, one at a
+    time on a thread of their own so the caller never waits on the disk, and the file
+    is read again if someone else changes it.
+
+    Other server processes edit the same file. A save holds a lock on it, reads it in
+    and makes our unsaved edits again on top, so it never throws away someone else's.
+    """
+
+    def __init__(
+        self, path: str, check_interval: float = 2.0, rng: random.Random = None
+    ):
+        """
+        :param path: text file with one word or phrase per line
+        :param check_interval: minimum seconds between checks of the file for changes
+        :param rng: source of randomness, for repeatable tests
+        """
+        self._path = path
+        self._check_interval = check_interval
+        self._rng = rng or random.Random()
+        self._lock = threading.RLock()
+
+        self._words: list[str] = []
+        self._bag: list[str] = []
+        # words already handed out since the bag was last refilled
+        self._drawn: set[str] = set()
+
+        self._file_state = None
+        self._next_check = 0
+        # (REMOVE or APPEND, word) made since the file was last written
+        self._unsaved: list[tuple[str, str]] = []
+        self._saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="words")
+        self.reload()
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, word):
+        return word in self._words
+
+    @property
+    def words(self) -> list[str]:
+        return list(self._words)
+
+    def next_word(self) -> str:
+        """
+        :raises IndexError: if the word list is empty
+        """
+        with self._lock:
+            self._reload_if_changed()
+
+            if not self._bag:
+                if not self._words:
+                    raise IndexError("The word list is empty")
+
+                self._drawn.clear()
+                self._bag = list(self._words)
+                self._rng.shuffle(self._bag)
+
+            word = self._bag.pop()
+            self._drawn.add(word)
+            return word
+
+    def remove(self, word: str) -> bool:
+        """
+        Removes a word for good, saving the list
+        :return: False if the word was not in the list
+        """
+        return self._edit(REMOVE, word)
+
+    def append(self, word: str) -> bool:
+        """
+        Adds a word to the end of the list, saving it
+        :return: False if the word was not allowed, see normalize_word, or is already in
+            the list in any case
+        """
+        word = normalize_word(word)
+        if word is None:
+            return False
+
+        return self._edit(APPEND, word)
+
+    def reload(self):
+        with self._lock:
+            with open(self._path, encoding="utf-8") as file:
+                self._file_state = self._stat()
+                words = [line.strip() for line in file.read().split("\n")]
+
+            self._words = [word for word in words if word]
+            # carry on with the current round, minus anything already handed out
+            self._bag = [word for word in self._words if word not in self._drawn]
+            self._rng.shuffle(self._bag)
+            self._next_check = time.monotonic() + self._check_interval
+
+            # ours are not in the file yet
+            for kind, word in self._unsaved:
+                self._apply(kind, word)
+
+    def _edit(self, kind: str, word: str) -> bool:
+        with self._lock:
+            # always looked at, an edit to an outdated list would undo someone else's
+            self._reload_if_changed(force=True)
+
+            if not self._apply(kind, word):
+                return False
+
+            self._unsaved.append((kind, word))
+            self._save()
+            return True
+
+    def _apply(self, kind: str, word: str) -> bool:
+        # caller holds the lock
+        if kind == REMOVE:
+            if word not in self._words:
+                return False
+
+            self._words.remove(word)
+            if word in self._bag:
+                self._bag.remove(word)
+            return True
+
+        folded = word.casefold()
+        if any(folded == known.casefold() for known in self._words):
+            return False
+
+        self._words.append(word)
+
+        # somewhere random in what is left of this round of the bag
+        self._bag.append(word)
+        index = self._rng.randrange(len(self._bag))
+        self._bag[index], self._bag[-1] = self._bag[-1], self._bag[index]
+        return True
+
+    def _reload_if_changed(self, force=False):
+        # caller holds the lock, the file is looked at every check_interval at most
+        if not force and time.monotonic() < self._next_check:
+            return
+
+        self._next_check = time.monotonic() + self._check_interval
+        state = self._stat()
+
+        # a missing file is most likely mid replace, keep what we have
+        if state is not None and state != self._file_state:
+            log.info("%s changed, reloading", self._path)
+            self.reload()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        # the inode tells apart saves too close together for the time to change
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _save(self):
+        # caller holds the lock, the saver thread writes whatever is unsaved by then
+        self._saver.submit(self._write)
+
+    def _write(self):
+        temporary = None
+
+        try:
+            with self._file_lock():
+                with self._lock:
+                    if not self._unsaved:
+                        # an earlier save took these edits along
+                        return
+
+                    # whatever the others saved, stat can not be trusted to tell
+                    self.reload()
+                    text = "\n".join(self._words)
+                    saving = len(self._unsaved)
+
+                # written next to the list and swapped in so a crash halfway through
+                # can never leave a half written list behind
+                directory = os.path.dirname(os.path.abspath(self._path))
+                handle, temporary = tempfile.mkstemp(dir=directory, prefix=".words-")
+
+                with os.fdopen(handle, "w", encoding="utf-8") as file:
+                    file.write(text)
+                    file.flush()
+                    os.fsync(file.fileno())
+
+                shutil.copymode(self._path, temporary)
+
+                # swapped in under the lock, our own save must not look like someone
+                # else's
+                with self._lock:
+                    os.replace(temporary, self._path)
+                    self._file_state = self._stat()
+                    del self._unsaved[:saving]
+        except OSError as error:
+            log.warning("Could not save %s, %s", self._path, error)
+        finally:
+            if temporary is not None and os.path.exists(temporary):
+                os.unlink(temporary)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        # other processes saving wait for us, closing the file releases it
+        with open(self._path + LOCK_EXTENSION, "a") as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            yield
@@ -0,0 +1,38 @@
+class StrokeCapture:
+    """
+    Every position the mouse went through while a tool is held down, taken from the
+    MOUSEMOTION events rather than the mouse's position once a frame
+
+    SDL queues a motion event for every position it saw, so fast strokes keep their
+    curves however low the frame rate. take() hands out what came in since the last
+    frame as one batch of points.
+    """
+
+    def __init__(self):
+        # (x, y) since the last take(), oldest first
+        self.points: list[tuple[int, int]] = []
+        self._last = None
+
+    def __bool__(self):
+        return bool(self.points)
+
+    def begin(self, position):
+        self.points.clear()
+        self._last = None
+        self.add(position)
+
+    def add(self, position):
+        position = tuple(position)
+        # the mouse resting in place still sends events now and then
+        if position == self._last:
+            return
+
+        self._last = position
+        self.points.append(position)
+
+    def take(self) -> list[tuple[int, int]]:
+        """
+        :return: the points since the last take, for Renderer.drawing
+        """
+        points, self.points = self.points, []
+        return points
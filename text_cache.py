@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+import pygame
+
+
+class TextCache:
+    """
+    Least recently used cache of rendered text surfaces for a single font
+    surfaces handed out are shared, blit them but never draw on them
+    """
+
+    def __init__(self, font: pygame.font.Font, max_bytes: int = 4 * 1024 * 1024):
+        self._font = font
+        self._max_bytes = max_bytes
+        self._surfaces: OrderedDict[tuple, pygame.Surface] = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self) -> int:
+        """
+        Approximate memory used by the cached surfaces in bytes
+        """
+        return self._bytes
+
+    def __len__(self):
+        return len(self._surfaces)
+
+    def render(
+        self, text: str, antialias: bool, color: tuple[int, ...]
+    ) -> pygame.Surface:
+        """
+        Drop in replacement for Font.render, only rasterizes text it has not seen recently
+        """
+        key = (text, antialias, tuple(color))
+        surface = self._surfaces.get(key)
+
+        if surface is not None:
+            self.hits += 1
+            self._surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = self._font.render(text, antialias, color)
+        self._surfaces[key] = surface
+        self._bytes += surface.get_pitch() * surface.get_height()
+
+        # always keep the newest surface, even if it alone is over budget
+        while self._bytes > self._max_bytes and len(self._surfaces) > 1:
+            _, evicted = self._surfaces.popitem(last=False)
+            self._bytes -= evicted.get_pitch() * evicted.get_height()
+
+        return surface
+
+    def clear(self):
+        self._surfaces.clear()
+        self._bytes = 0
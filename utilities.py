@@ -1,4 +1,5 @@
 import json
+from collections import deque
 import os
 import warnings
 
@@ -14,35 +15,55 @@ def split_by_max_length(inp: str, length: int, split_by_spaces=True) -> list[str
     """
 
     remainder = []
+    start = 0
+
+    # walk an offset along the string rather than re-slicing it, long pastes stay cheap
+    while len(inp) - start > length:
+        end = start + length
+        last_space = -1
+
+        if split_by_spaces:
+            last_space = inp.rfind(" ", start, end)
+
+        if last_space == -1:
+            # there are no spaces in the maximum string length
+            remainder.append(inp[start:end])
+            start = end
+        else:
+            remainder.append(inp[start:last_space])
+            start = last_space + 1
+
+    # what is left fits in width
+    remainder.append(inp[start:])
+    return remainder
 
-    if len(inp) <= length:
-        # string fits in width by default
-        remainder.append(inp)
-        return remainder
-
-    last_space = -1
-
-    if split_by_spaces:
-        temp_part = inp[:length]
-        last_space = temp_part.rfind(" ")
 
-    if last_space == -1:
-        # there are no spaces in the maximum string length
-        part, inp = inp[:length], inp[length:]
+class ChatLayout:
+    """
+    Keeps the most recent chat lines wrapped and ready to be drawn,
+    each message is only ever wrapped once
+    """
 
-        remainder.append(part)
-        remainder.extend(
-            split_by_max_length(inp, length, split_by_spaces=split_by_spaces)
-        )
+    def __init__(self, max_lines: int, max_length: int):
+        self.lines: deque[str] = deque(maxlen=max_lines)
+        self._max_length = max_length
+        self._laid_out = 0
 
-        return remainder
+    def add(self, message: str):
+        self.lines.extend(split_by_max_length(message, self._max_length))
 
-    part, inp = inp[:last_space], inp[last_space + 1:]
+    def update(self, chat_log: list[str]) -> bool:
+        """
+        Lays out any messages appended to chat_log since the last call
+        :return: True if there are new lines
+        """
+        new_messages = chat_log[self._laid_out :]
+        self._laid_out += len(new_messages)
 
-    remainder.append(part)
-    remainder.extend(split_by_max_length(inp, length, split_by_spaces=split_by_spaces))
+        for message in new_messages:
+            self.add(message)
 
-    return remainder
+        return bool(new_messages)
 
 
 def stringpop(i, string):
@@ -89,7 +110,13 @@ class _Settings:
             "ServerAddress": "0.0.0.0",
             "Port": 16324,
             "Name": "N00B",
+            "Room": "",
             "MouseSnap": False,
+            "FillTolerance": 0,
+            "FullRedraw": False,
+            "UndoBudgetMB": 64,
+            "MaxFps": 60,
+            "AdaptiveFps": True,
         }))
         file.close()
 
@@ -109,8 +136,16 @@ class _Settings:
         self._settings = {
             "ServerAddress": _settings.get("ServerAddress", "0.0.0.0"),
             "Name": _settings.get("Name", "N00B"),
+            "Room": _settings.get("Room", ""),
             "Port": _settings.get("Port", 16324),
-            "MouseSnap": _settings.get("MouseSnap", False)
+            "MouseSnap": _settings.get("MouseSnap", False),
+            "FillTolerance": _settings.get("FillTolerance", 0),
+            "FullRedraw": _settings.get("FullRedraw", False),
+            "UndoBudgetMB": _settings.get("UndoBudgetMB", 64),
+            # strokes keep every mouse position whatever this is, see StrokeCapture
+            "MaxFps": _settings.get("MaxFps", 60),
+            # only draw at MaxFps while something moves, sleep otherwise
+            "AdaptiveFps": _settings.get("AdaptiveFps", True),
         }
 
     @property